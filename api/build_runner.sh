@@ -48,6 +48,7 @@ apt-get install --no-install-recommends -qy \
   python3-pytest-benchmark\
   python3-pytest-cov \
   python3-pytest-mock \
+  python3-pytest-xdist \
   python3-setuptools \
   python3-sqlalchemy \
   python3-sqlalchemy-utils \
@@ -65,11 +65,27 @@ CREATE TABLE IF NOT EXISTS default.jsonl
     `input` String,
     `s3path` String,
     `linenum` Int32,
-    `measurement_uid` String
+    `measurement_uid` String,
+    `gz_offset` UInt64 DEFAULT 0,
+    `gz_length` UInt32 DEFAULT 0
 )
 ENGINE = MergeTree
 ORDER BY (report_id, input)
 SETTINGS index_granularity = 8192"""
+    )
+    # Skip index for the domain filter in list_measurements: the sorting
+    # key starts with measurement_start_time
+    run(
+        """
+ALTER TABLE default.fastpath
+ADD INDEX IF NOT EXISTS fastpath_domain_idx domain TYPE bloom_filter GRANULARITY 4"""
+    )
+    # Seek point of each measurement in jsonl.gz files: see ooni_api_uploader
+    run(
+        """
+ALTER TABLE default.jsonl
+ADD COLUMN IF NOT EXISTS `gz_offset` UInt64 DEFAULT 0,
+ADD COLUMN IF NOT EXISTS `gz_length` UInt32 DEFAULT 0"""
     )
     run(
         """
@@ -131,6 +147,18 @@ CREATE TABLE IF NOT EXISTS session_expunge
 ENGINE = EmbeddedRocksDB
 PRIMARY KEY account_id"""
     )
+    run(
+        """
+CREATE TABLE IF NOT EXISTS default.count_cache
+(
+    `filter_hash` String,
+    `cnt` UInt64,
+    `ts` DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(ts)
+ORDER BY filter_hash
+TTL ts + INTERVAL 1 DAY"""
+    )
 
     # Materialized views
     run(
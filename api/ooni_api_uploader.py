@@ -64,7 +64,8 @@ def update_db_table(conn, lookup_list, jsonl_s3path):
     for d in lookup_list:
         d["s3path"] = jsonl_s3path
 
-    q = "INSERT INTO jsonl (report_id, input, s3path, linenum, measurement_uid) VALUES"
+    cols = "report_id, input, s3path, linenum, measurement_uid, gz_offset, gz_length"
+    q = f"INSERT INTO jsonl ({cols}) VALUES"
     log.info(f"Writing {len(lookup_list)} rows to DB")
     conn.execute(q, lookup_list)
 
@@ -102,16 +103,21 @@ def fill_postcan(hourdir: PP, postcanf: PP) -> List[PP]:
 
 @metrics.timer("fill_jsonl")
 def fill_jsonl(measurements: List[PP], jsonlf: PP) -> List[Dict]:
+    """Write each measurement as a separate gzip member and record its
+    compressed offset and length. The concatenation is still a valid
+    jsonl.gz file but the API can fetch and decompress a single line
+    without scanning the whole file.
+    """
     log.info(f"Filling {jsonlf.name}")
     # report_id, input, 2020092119_IT_tor.n0.0.jsonl.gz
     lookup_list = []
-    with gzip.open(jsonlf, "w") as jf:
+    with jsonlf.open("wb") as jf:
         for linenum, msmt_f in enumerate(measurements):
             try:
                 post = ujson.load(msmt_f.open())
             except Exception:
                 log.error("Unable to parse measurement")
-                jf.write(b"{}\n")
+                jf.write(gzip.compress(b"{}\n"))
                 continue
 
             fmt = post.get("format", "").lower()
@@ -126,17 +132,22 @@ def fill_jsonl(measurements: List[PP], jsonlf: PP) -> List[Dict]:
 
             if msm is None:
                 log.error("Unable to parse measurement")
-                jf.write(b"{}\n")
+                jf.write(gzip.compress(b"{}\n"))
                 continue
 
-            jf.write(ujson.dumps(msm).encode())
-            jf.write(b"\n")
+            gz_offset = jf.tell()
+            gz_length = jf.write(gzip.compress(ujson.dumps(msm).encode() + b"\n"))
 
             rid = msm.get("report_id") or ""
             input = msm.get("input") or ""
             msmt_uid = msmt_f.name[:-5]
             d = dict(
-                report_id=rid, input=input, measurement_uid=msmt_uid, linenum=linenum
+                report_id=rid,
+                input=input,
+                measurement_uid=msmt_uid,
+                linenum=linenum,
+                gz_offset=gz_offset,
+                gz_length=gz_length,
             )
             lookup_list.append(d)
 
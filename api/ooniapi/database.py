@@ -47,14 +47,19 @@ def init_clickhouse_db(app) -> None:
     """Initializes Clickhouse session"""
     url = app.config["CLICKHOUSE_URL"]
     app.logger.info("Connecting to Clickhouse")
+    # One client per worker process: it keeps a persistent native TCP
+    # connection, reused across requests, and reconnects on failure.
+    # Not thread safe: gunicorn runs sync workers.
     app.click = Clickhouse.from_url(url)
 
 
 Query = Union[str, TextClause, Select]
 
 
-def _run_query(query: Query, query_params: dict, query_prio=3):
-    settings = {"priority": query_prio, "max_execution_time": 28}
+def _run_query(
+    query: Query, query_params: dict, query_prio=3, settings: Optional[dict] = None
+):
+    settings = {"priority": query_prio, "max_execution_time": 28, **(settings or {})}
     if isinstance(query, (Select, TextClause)):
         query = str(query.compile(dialect=postgresql.dialect()))
     try:
@@ -70,27 +75,63 @@ def _run_query(query: Query, query_params: dict, query_prio=3):
     return colnames, rows
 
 
-def query_click(query: Query, query_params: dict, query_prio=3) -> List[Dict]:
-    colnames, rows = _run_query(query, query_params, query_prio=query_prio)
+def query_click(
+    query: Query, query_params: dict, query_prio=3, settings: Optional[dict] = None
+) -> List[Dict]:
+    colnames, rows = _run_query(query, query_params, query_prio, settings)
     return [dict(zip(colnames, row)) for row in rows]
 
 
+def query_click_tuples(
+    query: Query, query_params: dict, query_prio=3, settings: Optional[dict] = None
+) -> List[tuple]:
+    """Like query_click, returns rows as tuples in SELECT order"""
+    colnames, rows = _run_query(query, query_params, query_prio, settings)
+    return rows
+
+
 def query_click_one_row(
-    query: Query, query_params: dict, query_prio=3
+    query: Query, query_params: dict, query_prio=3, settings: Optional[dict] = None
 ) -> Optional[dict]:
-    colnames, rows = _run_query(query, query_params, query_prio=query_prio)
+    colnames, rows = _run_query(query, query_params, query_prio, settings)
     for row in rows:
         return dict(zip(colnames, row))
 
     return None
 
 
+def query_cache_settings(
+    ttl: int, min_query_runs: int = 0, min_query_duration: int = 0
+) -> Optional[dict]:
+    """Settings for the ClickHouse >= 23.4 query result cache, to be passed
+    to query_click / query_click_one_row. Use only on read queries.
+    min_query_duration is in milliseconds.
+    Returns None unless CLICKHOUSE_QUERY_CACHE is enabled in the conf.
+    """
+    if not current_app.config.get("CLICKHOUSE_QUERY_CACHE", False):
+        return None
+    return {
+        "use_query_cache": 1,
+        "query_cache_ttl": ttl,
+        "query_cache_min_query_runs": min_query_runs,
+        "query_cache_min_query_duration": min_query_duration,
+        "query_cache_share_between_users": 1,
+    }
+
+
 def insert_click(query, rows: list) -> int:
     assert isinstance(rows, list)
     settings = {"priority": 1, "max_execution_time": 300}  # query_prio
     return current_app.click.execute(query, rows, types_check=True, settings=settings)
 
 
+def insert_select_click(query: Query, query_params: dict) -> int:
+    """Run INSERT ... SELECT, return the number of written rows"""
+    settings = {"priority": 1, "max_execution_time": 300}  # query_prio
+    current_app.click.execute(query, query_params, settings=settings)
+    return current_app.click.last_query.progress.written_rows
+
+
 def optimize_table(tblname: str) -> None:
     settings = {"priority": 1, "max_execution_time": 300}  # query_prio
     sql = f"OPTIMIZE TABLE {tblname} FINAL"
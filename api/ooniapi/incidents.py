@@ -15,6 +15,7 @@ Admins can update/delete everything.
 """
 
 from datetime import datetime
+from typing import Any, Dict, Optional
 import logging
 
 from flask import Blueprint, current_app, request, Response
@@ -26,11 +27,16 @@ from ooniapi.auth import (
     get_account_id_or_raise,
 )
 from ooniapi.config import metrics
-from ooniapi.database import query_click, optimize_table, insert_click, raw_query
+from ooniapi.database import (
+    insert_click,
+    insert_select_click,
+    query_click,
+    query_click_one_row,
+)
 from ooniapi.errors import BaseOONIException, jerror
 from ooniapi.errors import OwnershipPermissionError, InvalidRequest
 from ooniapi.urlparams import param_bool
-from ooniapi.utils import nocachejson, generate_random_intuid
+from ooniapi.utils import nocachejson, generate_random_intuid, TTLCache
 
 log: logging.Logger
 
@@ -39,12 +45,93 @@ log: logging.Logger
 # Updates/deletes are performed by ReplacingMergeTree based on update_time
 # against (title, event_type). We are not checking for the correct values
 # in the old dict during update/delete.
+# Deletions are done by inserting a tombstone row with deleted = 1: reads
+# use FINAL and filter out deleted rows. No OPTIMIZE or ALTER ... DELETE is
+# run on the write path: background merges take care of compaction.
 # "deleted" will be used automatically by Clickhouse version 23.3
+# Until then (CI runs 22.8) the engine cannot be declared as
+# ReplacingMergeTree(update_time, deleted) and FINAL is still needed.
+# The deleted != 1 filter must stay in WHERE: a PREWHERE would be applied
+# before FINAL, drop the tombstones and resurrect deleted incidents.
 #
 # The table creation for CI purposes is in tests/integ/clickhouse_1_schema.sql
 
 inc_blueprint = Blueprint("incidents_api", "incidents")
 
+# Process-local cache of serialized search/show responses.
+# Keys include the version of the incidents table: row count and latest
+# update_time. Any create/update/delete, from any API worker, adds a row
+# and changes the version, so entries cannot be served stale. Entries also
+# expire after RESPONSE_CACHE_TTL seconds and the cache is flushed on
+# writes handled by this process to release memory early.
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_MAX_SIZE = 1000
+_response_cache = TTLCache(RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL)
+
+# No FINAL: unmerged rows are exactly what makes the version change.
+# Merges only reduce the count, invalidating the cache spuriously.
+_VERSION_Q = "SELECT count() AS cnt, max(update_time) AS ts FROM incidents"
+
+
+def _table_version() -> tuple:
+    row = query_click_one_row(_VERSION_Q, {})
+    if row is None:
+        return (0, None)
+    return (row["cnt"], row["ts"])
+
+
+def _cache_get(key: tuple) -> Optional[Response]:
+    body = _response_cache.get(key)
+    if body is None:
+        return None
+    metrics.incr("incidents_cache_hit")
+    resp = Response(body, mimetype="application/json")
+    resp.cache_control.max_age = 0
+    resp.cache_control.no_cache = True
+    return resp
+
+
+def _cache_set(key: tuple, resp: Response) -> Response:
+    _response_cache.set(key, resp.get_data())
+    return resp
+
+
+def _cache_flush() -> None:
+    _response_cache.clear()
+
+
+# Queries are built once at import time. "mine" is always false for anon
+# users: skip the comparison on creator_account_id altogether.
+_MINE = "creator_account_id = %(account_id)s AS mine"
+_ANON_MINE = "toUInt8(0) AS mine"
+_SEARCH_Q = """SELECT id, update_time, start_time, end_time, reported_by,
+title, event_type, toBool(published) AS published,
+CCs, ASNs, domains, tags, test_names, links,
+short_description, {mine}
+FROM incidents FINAL
+WHERE deleted != 1{where}
+ORDER BY title
+"""
+# non-published incidents are not exposed to anon users
+_SEARCH_Q_ANON = _SEARCH_Q.format(mine=_ANON_MINE, where="\nAND published = 1")
+_SEARCH_Q_USER = _SEARCH_Q.format(mine=_MINE, where="")
+_SEARCH_Q_USER_ONLY_MINE = _SEARCH_Q.format(
+    mine=_MINE, where="\nAND creator_account_id = %(account_id)s"
+)
+
+# id is the sorting key: filtering it in PREWHERE is safe with FINAL
+_SHOW_Q = """SELECT id, update_time, start_time, end_time, reported_by,
+title, text, event_type, toBool(published) AS published,
+CCs, ASNs, domains, tags, test_names, links,
+short_description, {mine}
+FROM incidents FINAL
+PREWHERE id = %(id)s
+WHERE deleted != 1{where}
+LIMIT 1
+"""
+_SHOW_Q_ANON = _SHOW_Q.format(mine=_ANON_MINE, where="\nAND published = 1")
+_SHOW_Q_USER = _SHOW_Q.format(mine=_MINE, where="")
+
 
 @metrics.timer("search_list_incidents")
 @inc_blueprint.route("/api/v1/incidents/search", methods=["GET"])
@@ -56,6 +143,14 @@ def search_list_incidents() -> Response:
         in: query
         type: boolean
         description: Show only owned items
+      - name: limit
+        in: query
+        type: integer
+        description: Number of incidents to return (default all)
+      - name: offset
+        in: query
+        type: integer
+        description: Offset into the result set (default 0)
     responses:
       200:
         schema:
@@ -67,34 +162,45 @@ def search_list_incidents() -> Response:
     log = current_app.logger
     log.debug("listing incidents")
     try:
-        where = "WHERE deleted != 1"
-        query_params = {}
+        try:
+            limit: Optional[int] = None
+            if "limit" in request.args:
+                limit = int(request.args["limit"])
+            offset = int(request.args.get("offset", 0))
+        except ValueError:
+            raise InvalidRequest()
+        if (limit is not None and limit < 0) or offset < 0:
+            raise InvalidRequest()
+        query_params: Dict[str, Any] = dict(limit=limit, offset=offset)
 
         account_id = get_account_id_or_none()
-        if param_bool("only_mine"):
-            if account_id is None:
-                return nocachejson(incidents=[])
-            where += "\nAND creator_account_id = %(account_id)s"
-
+        only_mine = param_bool("only_mine")
+        version = _table_version()
+        cache_key = ("search", version, account_id, only_mine, limit, offset)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        # The ClickHouse query cache is not used: it cannot be invalidated
+        # on writes
         if account_id is None:
-            # non-published incidents are not exposed to anon users
-            where += "\nAND published = 1"
-            query_params["account_id"] = "never-match"
+            if only_mine:
+                return nocachejson(incidents=[])
+            query = _SEARCH_Q_ANON
         else:
+            query = _SEARCH_Q_USER_ONLY_MINE if only_mine else _SEARCH_Q_USER
             query_params["account_id"] = account_id
 
-        query = f"""SELECT id, update_time, start_time, end_time, reported_by,
-        title, event_type, published, CCs, ASNs, domains, tags, test_names,
-        links, short_description, creator_account_id = %(account_id)s AS mine
-        FROM incidents FINAL
-        {where}
-        ORDER BY title
-        """
-        q = query_click(query, query_params)
-        rows = list(q)
-        for r in rows:
-            r["published"] = bool(r["published"])
-        return nocachejson(incidents=rows, v=1)
+        # No title projection: ClickHouse does not use projections with
+        # FINAL, which is needed until the engine can handle "deleted".
+        # The whole table is listed unless a limit is requested.
+        if limit is not None:
+            query += "LIMIT %(limit)s OFFSET %(offset)s\n"
+        elif offset:
+            query += "OFFSET %(offset)s ROWS\n"
+
+        rows = query_click(query, query_params)
+        return _cache_set(cache_key, nocachejson(incidents=rows, v=1))
     except BaseOONIException as e:
         return jerror(e)
 
@@ -116,36 +222,29 @@ def show_incident(incident_id: str) -> Response:
     log = current_app.logger
     log.debug("showing incident")
     try:
-        where = "WHERE id = %(id)s AND deleted != 1"
         account_id = get_account_id_or_none()
+        cache_key = ("show", _table_version(), incident_id, account_id)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return cached
+
         if account_id is None:
-            # non-published incidents are not exposed to anon users
-            where += "\nAND published = 1"
-            query_params = {"id": incident_id, "account_id": "never-match"}
+            query = _SHOW_Q_ANON
+            query_params = {"id": incident_id}
         else:
+            query = _SHOW_Q_USER
             query_params = {"id": incident_id, "account_id": account_id}
 
-        query = f"""SELECT id, update_time, start_time, end_time, reported_by,
-        title, text, event_type, published, CCs, ASNs, domains, tags, test_names,
-        links, short_description, creator_account_id = %(account_id)s AS mine
-        FROM incidents FINAL
-        {where}
-        LIMIT 1
-        """
         q = query_click(query, query_params)
         if len(q) < 1:
             return jerror("Not found")
-        inc = q[0]
-        inc["published"] = bool(inc["published"])
-        # TODO: cache if possible
-        return nocachejson(incident=inc, v=1)
+        return _cache_set(cache_key, nocachejson(incident=q[0], v=1))
     except BaseOONIException as e:
         return jerror(e)
 
 
-def prepare_incident_dict(d: dict):
-    d["creator_account_id"] = get_account_id_or_raise()
-    exp = [
+_REQUIRED_KEYS = frozenset(
+    (
         "ASNs",
         "CCs",
         "creator_account_id",
@@ -161,15 +260,49 @@ def prepare_incident_dict(d: dict):
         "tags",
         "test_names",
         "text",
-        "title"
-    ]
-    if sorted(d) != exp:
+        "title",
+    )
+)
+
+
+def _is_asn(asn) -> bool:
+    if isinstance(asn, int):
+        return True
+    return isinstance(asn, str) and asn.lstrip("-").isdigit()
+
+
+def _parse_utc_timestamp(ts: str) -> datetime:
+    """Parse timestamps in the format "%Y-%m-%dT%H:%M:%SZ" as naive datetime"""
+    # fromisoformat also accepts dates, fractional seconds and UTC offsets:
+    # enforce the exact shape first
+    if (
+        len(ts) != 20
+        or ts[4] != "-"
+        or ts[7] != "-"
+        or ts[10] != "T"
+        or ts[13] != ":"
+        or ts[16] != ":"
+        or ts[19] != "Z"
+    ):
+        raise InvalidRequest()
+    try:
+        dt = datetime.fromisoformat(ts[:-1])
+    except ValueError:
+        raise InvalidRequest()
+    if dt.tzinfo is not None:
+        raise InvalidRequest()
+    return dt
+
+
+def prepare_incident_dict(d: dict):
+    d["creator_account_id"] = get_account_id_or_raise()
+    if d.keys() != _REQUIRED_KEYS:
         log.debug(f"Invalid incident update request. Keys: {sorted(d)}")
         raise InvalidRequest()
 
-    d["start_time"] = datetime.strptime(d["start_time"], "%Y-%m-%dT%H:%M:%SZ")
+    d["start_time"] = _parse_utc_timestamp(d["start_time"])
     if d["end_time"] is not None:
-        d["end_time"] = datetime.strptime(d["end_time"], "%Y-%m-%dT%H:%M:%SZ")
+        d["end_time"] = _parse_utc_timestamp(d["end_time"])
         delta = d["end_time"] - d["start_time"]
         if delta.total_seconds() < 0:
             raise InvalidRequest()
@@ -178,13 +311,53 @@ def prepare_incident_dict(d: dict):
         log.debug("Invalid incident update request: empty title or desc")
         raise InvalidRequest()
 
-    try:
-        for asn in d["ASNs"]:
-            int(asn)
-    except Exception:
+    if not all(_is_asn(asn) for asn in d["ASNs"]):
         raise InvalidRequest()
 
 
+# Columns written on create/update, in insertion order
+_INCIDENT_COLS = (
+    "id",
+    "start_time",
+    "end_time",
+    "creator_account_id",
+    "reported_by",
+    "title",
+    "text",
+    "event_type",
+    "published",
+    "CCs",
+    "ASNs",
+    "domains",
+    "tags",
+    "links",
+    "test_names",
+    "short_description",
+)
+_INSERT_INCIDENT_SQL = "INSERT INTO incidents ({}) VALUES".format(
+    ", ".join(_INCIDENT_COLS)
+)
+
+
+# Used by non-admin users: the row is written only if the incident does not
+# already exist under a different owner. The ownership check and the write
+# happen in a single query.
+_OWNED_CHECK = """WHERE (
+    SELECT count() FROM incidents FINAL
+    WHERE deleted != 1
+    AND id = %(id)s
+    AND creator_account_id != %(creator_account_id)s
+) = 0
+"""
+
+
+_INSERT_OWNED_INCIDENT_SQL = "INSERT INTO incidents ({})\nSELECT {}\n{}".format(
+    ", ".join(_INCIDENT_COLS),
+    ", ".join(f"%({c})s" for c in _INCIDENT_COLS),
+    _OWNED_CHECK,
+)
+
+
 def user_cannot_update(incident_id: str) -> bool:
     # Check if there is already an incident and belogs to a different user
     query = """SELECT count() AS cnt
@@ -196,8 +369,111 @@ def user_cannot_update(incident_id: str) -> bool:
     account_id = get_account_id_or_raise()
     query_params = dict(incident_id=incident_id, account_id=account_id)
     q = query_click(query, query_params)
-    log.debug("An incident beloging to a different user has been found")
-    return q[0]["cnt"] > 0
+    if q[0]["cnt"] > 0:
+        log.debug("An incident beloging to a different user has been found")
+        return True
+    return False
+
+
+def insert_owned_incident(req: dict) -> int:
+    """Insert an incident update if owned by the caller.
+    Raise OwnershipPermissionError otherwise"""
+    r = insert_select_click(_INSERT_OWNED_INCIDENT_SQL, req)
+    if r == 0:
+        log.debug("An incident beloging to a different user has been found")
+        raise OwnershipPermissionError
+    return r
+
+
+# The tombstone is a copy of the current row with deleted = 1 and a new
+# update_time, generated server-side in one query.
+_DELETE_INCIDENT_SQL = """INSERT INTO incidents ({cols}, deleted)
+SELECT {cols}, 1 FROM incidents FINAL
+WHERE id = %(id)s AND deleted != 1
+""".format(
+    cols=", ".join(_INCIDENT_COLS)
+)
+
+
+def delete_incident(incident_id: str, is_admin: bool) -> None:
+    """Insert a tombstone for an incident. Deleting a missing incident is
+    a no-op. Raise OwnershipPermissionError if a non-admin caller does not
+    own it"""
+    query = _DELETE_INCIDENT_SQL
+    query_params = dict(id=incident_id)
+    if not is_admin:
+        query += "AND creator_account_id = %(creator_account_id)s"
+        query_params["creator_account_id"] = get_account_id_or_raise()
+
+    written = insert_select_click(query, query_params)
+    if written == 0 and not is_admin:
+        # Tell apart "not found" from "not owned": only on the error path
+        if user_cannot_update(incident_id):
+            raise OwnershipPermissionError
+
+
+def _insert_incident(req: dict) -> Response:
+    prepare_incident_dict(req)
+    # Rows as tuples in column order: no per-column dict lookups in the
+    # driver when building the native insert block
+    row = tuple(req[c] for c in _INCIDENT_COLS)
+    r = insert_click(_INSERT_INCIDENT_SQL, [row])
+    log.debug(f"Result: {r}")
+    _cache_flush()
+    return nocachejson(r=r, id=req["id"])
+
+
+def _create_incident(req: dict) -> Response:
+    req["id"] = str(generate_random_intuid(current_app))
+    log.info(f"Creating incident {req['id']}")
+    return _insert_incident(req)
+
+
+def _create_incident_user(req: dict) -> Response:
+    if req["published"] == 1:
+        raise InvalidRequest
+    return _create_incident(req)
+
+
+def _update_incident(req: dict) -> Response:
+    log.info(f"Updating incident {req['id']}")
+    return _insert_incident(req)
+
+
+def _update_incident_user(req: dict) -> Response:
+    if req["published"] == 1:
+        # Ownership errors take precedence
+        if user_cannot_update(req["id"]):
+            raise OwnershipPermissionError
+        raise InvalidRequest
+    prepare_incident_dict(req)
+    r = insert_owned_incident(req)
+    log.info(f"Updated incident {req['id']}")
+    _cache_flush()
+    return nocachejson(r=r, id=req["id"])
+
+
+def _delete_incident(req: dict) -> Response:
+    delete_incident(req["id"], True)
+    _cache_flush()
+    return nocachejson()
+
+
+def _delete_incident_user(req: dict) -> Response:
+    delete_incident(req["id"], False)
+    _cache_flush()
+    return nocachejson()
+
+
+# (action, is_admin) -> handler
+_HANDLERS = {
+    ("create", True): _create_incident,
+    ("create", False): _create_incident_user,
+    ("update", True): _update_incident,
+    ("update", False): _update_incident_user,
+    ("delete", True): _delete_incident,
+    ("delete", False): _delete_incident_user,
+}
 
 
 @metrics.timer("post_update_incident")
@@ -267,7 +543,8 @@ def post_update_incident(action: str) -> Response:
     # See comments on top of file
     global log
     log = current_app.logger
-    if action not in ("create", "update", "delete"):
+    handler = _HANDLERS.get((action, get_client_role() == "admin"))
+    if handler is None:
         return jerror("Invalid request")  # TODO
 
     try:
@@ -277,50 +554,13 @@ def post_update_incident(action: str) -> Response:
 
         req["published"] = int(req.get("published", 0))
 
-        if action in ("update", "delete"):
+        if action != "create":
             incident_id = req.get("id")
             if incident_id is None:
                 raise InvalidRequest()
-            incident_id = str(incident_id)
-
-        if action == "create":
-            incident_id = str(generate_random_intuid(current_app))
-            req["id"] = incident_id
-            if get_client_role() != "admin" and req["published"] == 1:
-                raise InvalidRequest
-
-            log.info(f"Creating incident {incident_id}")
-
-        elif action == "update":
-            if get_client_role() != "admin":
-                if user_cannot_update(incident_id):
-                    raise OwnershipPermissionError
-                if req["published"] == 1:
-                    raise InvalidRequest
-
-            log.info(f"Updating incident {incident_id}")
-
-        elif action == "delete":
-            if get_client_role() != "admin":
-                if user_cannot_update(incident_id):
-                    raise OwnershipPermissionError
-            # TODO: switch to faster deletion with new db version
-            q = "ALTER TABLE incidents DELETE WHERE id = %(iid)s"
-            raw_query(q, {"iid": incident_id})
-            optimize_table("incidents")
-            return nocachejson()
-
-        ins_sql = """INSERT INTO incidents
-        (id, start_time, end_time, creator_account_id, reported_by, title,
-        text, event_type, published, CCs, ASNs, domains, tags, links,
-        test_names, short_description)
-        VALUES
-        """
-        prepare_incident_dict(req)
-        r = insert_click(ins_sql, [req])
-        log.debug(f"Result: {r}")
-        optimize_table("incidents")
-        return nocachejson(r=r, id=incident_id)
+            req["id"] = str(incident_id)
+
+        return handler(req)
 
     except Exception as e:
         log.info(e, exc_info=True)
@@ -3,35 +3,50 @@ Measurements API
 The routes are mounted under /api
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
 from dateutil.parser import parse as parse_date
 from pathlib import Path
-from typing import Optional, Any, Dict
+from functools import lru_cache
+from io import BufferedReader
+from itertools import product
+from typing import Optional, Any, Dict, Tuple
+import base64
 import gzip
-import json
+import hashlib
 import logging
 import math
+import re
+import threading
 import time
 
 import ujson  # debdeps: python3-ujson
 import urllib3  # debdeps: python3-urllib3
+from clickhouse_driver import Client as Clickhouse
 
 from flask import current_app, request, make_response, abort, redirect, Response
 from flask.json import jsonify
 from werkzeug.exceptions import HTTPException, BadRequest
 
 # debdeps: python3-sqlalchemy
-from sqlalchemy import and_, text, select, sql, column
+from sqlalchemy import and_, text, select, sql
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import OperationalError
 from psycopg2.extensions import QueryCanceledError  # debdeps: python3-psycopg2
 
-from urllib.request import urlopen
 from urllib.parse import urljoin, urlencode
 
 from ooniapi.auth import role_required, get_account_id_or_none
 from ooniapi.config import metrics
 from ooniapi.utils import cachedjson, nocachejson, jerror
-from ooniapi.database import query_click, query_click_one_row
+from ooniapi.utils import TTLCache, ttl_cache
+from ooniapi.database import (
+    query_cache_settings,
+    query_click,
+    query_click_one_row,
+    query_click_tuples,
+)
 from ooniapi.urlparams import (
     param_asn,
     param_bool,
@@ -81,21 +96,29 @@ def list_files() -> Response:
     return cachedjson("1d", msg="not implemented")
 
 
+# Fixed queries are plain strings using the clickhouse_driver %(name)s
+# placeholders: they need no SQLAlchemy parsing and compilation per call.
+_Q_UID_TO_S3 = """SELECT s3path, linenum, gz_offset, gz_length FROM jsonl
+PREWHERE (report_id, input) IN (
+    SELECT report_id, input FROM fastpath WHERE measurement_uid = %(uid)s
+)
+LIMIT 1"""
+
+_Q_RID_INPUT_TO_S3 = """SELECT s3path, linenum, gz_offset, gz_length FROM jsonl
+PREWHERE report_id = %(report_id)s AND input = %(inp)s
+LIMIT 1"""
+
+
+# Measurement bodies and their location never change once written
+@ttl_cache("msmt_uid_lookup", 4096, 600)
 def measurement_uid_to_s3path_linenum(measurement_uid: str):
     # TODO: cleanup this
-    query = """SELECT s3path, linenum FROM jsonl
-        PREWHERE (report_id, input) IN (
-            SELECT report_id, input FROM fastpath WHERE measurement_uid = :uid
-        )
-        LIMIT 1"""
     query_params = dict(uid=measurement_uid)
-    lookup = query_click_one_row(sql.text(query), query_params, query_prio=3)
+    lookup = query_click_one_row(_Q_UID_TO_S3, query_params, query_prio=3)
     if lookup is None:
         raise MsmtNotFound
 
-    s3path = lookup["s3path"]
-    linenum = lookup["linenum"]
-    return s3path, linenum
+    return lookup["s3path"], lookup["linenum"], lookup["gz_offset"], lookup["gz_length"]
 
 
 @metrics.timer("get_measurement")
@@ -122,13 +145,17 @@ def get_measurement(measurement_uid) -> Response:
     param = request.args.get
     download = param("download", "").lower() == "true"
     try:
-        s3path, linenum = measurement_uid_to_s3path_linenum(measurement_uid)
+        s3path, linenum, gz_offset, gz_length = measurement_uid_to_s3path_linenum(
+            measurement_uid
+        )
     except MsmtNotFound:
         return jerror("Incorrect or inexistent measurement_uid")
 
     log.debug(f"Fetching file {s3path} from S3")
     try:
-        body = _fetch_jsonl_measurement_body_from_s3(s3path, linenum)
+        body = _fetch_jsonl_measurement_body_from_s3(
+            s3path, linenum, gz_offset, gz_length
+        )
     except Exception:  # pragma: no cover
         log.error(f"Failed to fetch file {s3path} from S3")
         return jerror("Incorrect or inexistent measurement_uid")
@@ -145,31 +172,97 @@ def get_measurement(measurement_uid) -> Response:
 # # Fetching measurement bodies
 
 
+_SCAN_CHUNK_SIZE = 1 << 20
+
+
+def _read_line(f, linenum: int) -> Optional[bytes]:
+    """Read line number <linenum> from a file, including the newline.
+    Decompress in large chunks and skip lines using bytes methods
+    instead of iterating line by line.
+    """
+    skip = linenum
+    buf = b""
+    while True:
+        chunk = f.read(_SCAN_CHUNK_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+        if skip:
+            cnt = buf.count(b"\n")
+            if cnt < skip:
+                skip -= cnt
+                buf = buf[buf.rfind(b"\n") + 1 :]
+                continue
+            buf = buf.split(b"\n", skip)[skip]
+            skip = 0
+
+        end = buf.find(b"\n")
+        if end != -1:
+            return buf[: end + 1]
+
+    if skip == 0 and buf:
+        return buf  # last line without trailing newline
+    return None
+
+
+def _check_s3_response(r, expected_status: int, url: str) -> None:
+    """Fail on missing or empty S3 objects using only the response headers,
+    before reading the body
+    """
+    if r.status == 404:
+        metrics.incr("s3_missing")
+        log.error(f"Missing S3 object {url}")
+        raise MsmtNotFound
+
+    if r.status != expected_status or r.headers.get("Content-Length") == "0":
+        log.error(f"Unexpected S3 response {r.status} for {url}")
+        raise MsmtNotFound
+
+
+@ttl_cache("jsonl_body", 512, 3600, max_item_size=256 * 1024)
 @metrics.timer("_fetch_jsonl_measurement_body_from_s3")
 def _fetch_jsonl_measurement_body_from_s3(
     s3path: str,
     linenum: int,
+    gz_offset: int = 0,
+    gz_length: int = 0,
 ) -> bytes:
     log = current_app.logger
     bucket_name = current_app.config["S3_BUCKET_NAME"]
     baseurl = f"https://{bucket_name}.s3.amazonaws.com/"
     url = urljoin(baseurl, s3path)
+    if gz_length:
+        # The uploader writes each msmt as a separate gzip member and
+        # records its position: fetch and decompress only that member.
+        log.info(f"Fetching {url} bytes {gz_offset}+{gz_length}")
+        rng = f"bytes={gz_offset}-{gz_offset + gz_length - 1}"
+        r = urllib_pool.request("GET", url, headers={"Range": rng})
+        _check_s3_response(r, 206, url)
+        return gzip.decompress(r.data)
+
+    # Files written before the seek points were recorded: scan
     log.info(f"Fetching {url}")
-    r = urlopen(url)
-    f = gzip.GzipFile(fileobj=r, mode="r")
-    for n, line in enumerate(f):
-        if n == linenum:
+    r = urllib_pool.request("GET", url, preload_content=False)
+    try:
+        _check_s3_response(r, 200, url)
+        f = gzip.GzipFile(fileobj=BufferedReader(r, _SCAN_CHUNK_SIZE), mode="r")
+        line = _read_line(f, linenum)
+        if line is not None:
             return line
 
+    finally:
+        # Stop the download as soon as the line is found. The connection
+        # cannot be reused with unread data: close it.
+        r.close()
+        r.release_conn()
+
     raise MsmtNotFound
 
 
+@ttl_cache("rid_input_lookup", 4096, 600)
 def report_id_input_to_s3path_linenum(report_id: str, input: str):
-    query = """SELECT s3path, linenum FROM jsonl
-        PREWHERE report_id = :report_id AND input = :inp
-        LIMIT 1"""
     query_params = dict(inp=input, report_id=report_id)
-    lookup = query_click_one_row(sql.text(query), query_params, query_prio=3)
+    lookup = query_click_one_row(_Q_RID_INPUT_TO_S3, query_params, query_prio=3)
 
     if lookup is None:
         m = f"Missing row in jsonl table: {report_id} {input}"
@@ -177,22 +270,26 @@ def report_id_input_to_s3path_linenum(report_id: str, input: str):
         metrics.incr("msmt_not_found_in_jsonl")
         raise MsmtNotFound
 
-    s3path = lookup["s3path"]
-    linenum = lookup["linenum"]
-    return s3path, linenum
+    return lookup["s3path"], lookup["linenum"], lookup["gz_offset"], lookup["gz_length"]
 
 
 @metrics.timer("_fetch_jsonl_measurement_body_clickhouse")
 def _fetch_jsonl_measurement_body_clickhouse(
-    report_id: str, input: Optional[str], measurement_uid: Optional[str]
+    report_id: str,
+    input: Optional[str],
+    measurement_uid: Optional[str],
+    jsonl_location: Optional[tuple] = None,
 ) -> Optional[bytes]:
     """
     Fetch jsonl from S3, decompress it, extract single msmt
     """
     # TODO: switch to _fetch_measurement_body_by_uid
-    if measurement_uid is not None:
+    if jsonl_location:
+        lookup = jsonl_location
+
+    elif measurement_uid is not None:
         try:
-            s3path, linenum = measurement_uid_to_s3path_linenum(measurement_uid)
+            lookup = measurement_uid_to_s3path_linenum(measurement_uid)
         except MsmtNotFound:
             log.error(f"Measurement {measurement_uid} not found in jsonl")
             return None
@@ -200,14 +297,15 @@ def _fetch_jsonl_measurement_body_clickhouse(
     else:
         try:
             inp = input or ""  # NULL/None input is stored as ''
-            s3path, linenum = report_id_input_to_s3path_linenum(report_id, inp)
+            lookup = report_id_input_to_s3path_linenum(report_id, inp)
         except Exception:
             log.error(f"Measurement {report_id} {inp} not found in jsonl")
             return None
 
+    s3path = lookup[0]
     try:
         log.debug(f"Fetching file {s3path} from S3")
-        return _fetch_jsonl_measurement_body_from_s3(s3path, linenum)
+        return _fetch_jsonl_measurement_body_from_s3(*lookup)
     except Exception:  # pragma: no cover
         log.error(f"Failed to fetch file {s3path} from S3")
         return None
@@ -220,6 +318,50 @@ def _unwrap_post(post: dict) -> dict:
     raise Exception("Unexpected format")
 
 
+# Envelope written by probes: {"format": "json", "content": {...}}
+_POST_JSON_PREFIX = re.compile(rb'\A\s*\{\s*"format"\s*:\s*"json"\s*,\s*"content"\s*:')
+_JSON_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+_JSON_BRACE = re.compile(rb"[{}]")
+
+
+def _slice_post_content(data: bytes) -> Optional[bytes]:
+    """Extract the content of a JSON POST envelope without decoding and
+    re-encoding the measurement. Returns None if the envelope has a
+    different layout.
+    Only the envelope is checked, the measurement is not parsed.
+    """
+    m = _POST_JSON_PREFIX.match(data)
+    if m is None:
+        return None
+    data = data.rstrip()
+    if not data.endswith(b"}"):
+        return None
+    body = data[m.end() : -1].strip()
+    if not body.startswith(b"{"):
+        return None
+    # The content object must close at the end of body, otherwise more keys
+    # follow it. Strings are blanked out as they can contain braces.
+    blanked = _JSON_STRING.sub(b'""', body)
+    if not blanked.endswith(b"}"):
+        return None
+    braces = _JSON_BRACE.findall(blanked)
+    depth = 0
+    for n, brace in enumerate(braces, 1):
+        depth += 1 if brace == b"{" else -1
+        if depth == 0:
+            return body if n == len(braces) else None
+    return None
+
+
+def _post_to_body(data: bytes) -> bytes:
+    """Extract msmt from a raw POST"""
+    body = _slice_post_content(data)
+    if body is not None:
+        return body
+    post = ujson.loads(data)
+    return ujson.dumps(_unwrap_post(post)).encode()
+
+
 @metrics.timer("_fetch_measurement_body_on_disk_by_msmt_uid")
 def _fetch_measurement_body_on_disk_by_msmt_uid(msmt_uid: str) -> Optional[bytes]:
     """Fetch raw POST from disk, extract msmt
@@ -235,12 +377,10 @@ def _fetch_measurement_body_on_disk_by_msmt_uid(msmt_uid: str) -> Optional[bytes
     postf = spooldir / f"{hour}_{cc}_{testname}/{msmt_uid}.post"
     log.debug(f"Attempt at reading {postf}")
     try:
-        with postf.open() as f:
-            post = ujson.load(f)
+        data = postf.read_bytes()
     except FileNotFoundError:
         return None
-    body = _unwrap_post(post)
-    return ujson.dumps(body).encode()
+    return _post_to_body(data)
 
 
 def _fetch_measurement_body_by_uid(msmt_uid: str) -> bytes:
@@ -251,8 +391,29 @@ def _fetch_measurement_body_by_uid(msmt_uid: str) -> bytes:
         return body
 
     log.debug(f"Fetching body for UID {msmt_uid} from jsonl on S3")
-    s3path, linenum = measurement_uid_to_s3path_linenum(msmt_uid)
-    return _fetch_jsonl_measurement_body_from_s3(s3path, linenum)
+    lookup = measurement_uid_to_s3path_linenum(msmt_uid)
+    return _fetch_jsonl_measurement_body_from_s3(*lookup)
+
+
+_hosts_executor = ThreadPoolExecutor(max_workers=8)
+_hosts_timeout = urllib3.Timeout(connect=0.5, read=2.0)
+
+
+def _fetch_post_from_host(url: str) -> Optional[bytes]:
+    log.debug(f"Attempt to load {url}")
+    try:
+        r = urllib_pool.request("GET", url, timeout=_hosts_timeout)
+        if r.status == 404:
+            log.debug("not found")
+            return None
+        elif r.status != 200:
+            log.error(f"unexpected status {r.status}")
+            return None
+
+        return _post_to_body(r.data)
+    except Exception:
+        log.info("Error", exc_info=True)
+        return None
 
 
 @metrics.timer("_fetch_measurement_body_from_hosts")
@@ -271,36 +432,56 @@ def _fetch_measurement_body_from_hosts(msmt_uid: str) -> Optional[bytes]:
         log.info("Error", exc_info=True)
         return None
 
+    # Query all hosts in parallel and use the first body found
+    futures = set()
     for hostname in current_app.config["OTHER_COLLECTORS"]:
         url = urljoin(f"https://{hostname}/measurement_spool/", path)
-        log.debug(f"Attempt to load {url}")
-        try:
-            r = urllib_pool.request("GET", url)
-            if r.status == 404:
-                log.debug("not found")
-                continue
-            elif r.status != 200:
-                log.error(f"unexpected status {r.status}")
-                continue
+        futures.add(_hosts_executor.submit(_fetch_post_from_host, url))
 
-            post = ujson.loads(r.data)
-            body = _unwrap_post(post)
-            return ujson.dumps(body).encode()
-        except Exception:
-            log.info("Error", exc_info=True)
-            pass
+    while futures:
+        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+        for fu in done:
+            body = fu.result()
+            if body is not None:
+                for pending in futures:
+                    pending.cancel()
+                return body
 
     return None
 
 
+def _fetch_spooled_measurement_body(msmt_uid: str) -> Optional[bytes]:
+    """Fetch a msmt from the local spool or from other hosts. The local
+    spool gets a head start: other hosts are queried only on miss or if
+    reading from disk is unusually slow.
+    """
+    disk = _hosts_executor.submit(_fetch_measurement_body_on_disk_by_msmt_uid, msmt_uid)
+    try:
+        return disk.result(timeout=0.05) or _fetch_measurement_body_from_hosts(msmt_uid)
+    except FutureTimeoutError:
+        pass
+
+    return _fetch_measurement_body_from_hosts(msmt_uid) or disk.result()
+
+
+@ttl_cache("fresh_uid_threshold", 1, 60)
+def _fresh_uid_threshold() -> str:
+    """Return the measurement_uid prefix for 1 hour ago, e.g. 202107090055"""
+    return (datetime.utcnow() - timedelta(hours=1)).strftime("%Y%m%d%H%M")
+
+
 @metrics.timer("fetch_measurement_body")
 def _fetch_measurement_body(
-    report_id: str, input: Optional[str], measurement_uid: str
+    report_id: str,
+    input: Optional[str],
+    measurement_uid: str,
+    jsonl_location: Optional[tuple] = None,
 ) -> bytes:
     """Fetch measurement body from either:
     - local measurement spool dir (.post files)
     - JSONL files on S3
     - remote measurement spool dir (another API/collector host)
+    jsonl_location, if already known, skips the jsonl table lookup
     """
     # TODO: uid_cleanup
     log.debug(f"Fetching body for {report_id} {input}")
@@ -310,29 +491,28 @@ def _fetch_measurement_body(
     new_format = u_count == 5 and measurement_uid
 
     if new_format:
-        ts = (datetime.utcnow() - timedelta(hours=1)).strftime("%Y%m%d%H%M")
-        fresh = measurement_uid > ts
+        fresh = measurement_uid > _fresh_uid_threshold()
 
     # Do the fetching in different orders based on the likelyhood of success
     if new_format and fresh:
-        body = (
-            _fetch_measurement_body_on_disk_by_msmt_uid(measurement_uid)
-            or _fetch_measurement_body_from_hosts(measurement_uid)
-            or _fetch_jsonl_measurement_body_clickhouse(
-                report_id, input, measurement_uid
+        body = _fetch_spooled_measurement_body(measurement_uid)
+        if not body:
+            body = _fetch_jsonl_measurement_body_clickhouse(
+                report_id, input, measurement_uid, jsonl_location
             )
-        )
 
     elif new_format and not fresh:
         body = (
-            _fetch_jsonl_measurement_body_clickhouse(report_id, input, measurement_uid)
+            _fetch_jsonl_measurement_body_clickhouse(
+                report_id, input, measurement_uid, jsonl_location
+            )
             or _fetch_measurement_body_on_disk_by_msmt_uid(measurement_uid)
             or _fetch_measurement_body_from_hosts(measurement_uid)
         )
 
     else:
         body = _fetch_jsonl_measurement_body_clickhouse(
-            report_id, input, measurement_uid
+            report_id, input, measurement_uid, jsonl_location
         )
 
     if body:
@@ -343,12 +523,30 @@ def _fetch_measurement_body(
     raise MsmtNotFound
 
 
+_url_safe = re.compile(r"[A-Za-z0-9._-]*\Z")
+
+
 def genurl(path: str, **kw) -> str:
     """Generate absolute URL for the API"""
     base = current_app.config["BASE_URL"]
     return urljoin(base, path) + "?" + urlencode(kw)
 
 
+def _encode_cursor(measurement_start_time: datetime, measurement_uid: str) -> str:
+    """Encode the last row of a page into an opaque pagination cursor"""
+    c = f"{measurement_start_time:%Y-%m-%dT%H:%M:%S}_{measurement_uid}"
+    return base64.urlsafe_b64encode(c.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        c = base64.urlsafe_b64decode(cursor.encode()).decode()
+        t, _, uid = c.partition("_")
+        return datetime.strptime(t, "%Y-%m-%dT%H:%M:%S"), uid
+    except Exception:
+        raise BadRequest("Invalid cursor")
+
+
 @api_msm_blueprint.route("/v1/raw_measurement")
 @metrics.timer("get_raw_measurement")
 def get_raw_measurement() -> Response:
@@ -376,17 +574,20 @@ def get_raw_measurement() -> Response:
     try:
         msmt_uid = param_measurement_uid()
         # TODO: uid_cleanup
-        msmt_meta = _get_measurement_meta_by_uid(msmt_uid)
+        msmt_meta = _get_measurement_meta_by_uid(msmt_uid, True)
     except Exception:
         report_id = param_report_id()
         param = request.args.get
         input_ = param("input")
         # _fetch_measurement_body needs the UID
-        msmt_meta = _get_measurement_meta_clickhouse(report_id, input_)
+        msmt_meta = _get_measurement_meta_clickhouse(report_id, input_, True)
 
     if msmt_meta:
         body = _fetch_measurement_body(
-            msmt_meta["report_id"], msmt_meta["input"], msmt_meta["measurement_uid"]
+            msmt_meta["report_id"],
+            msmt_meta["input"],
+            msmt_meta["measurement_uid"],
+            msmt_meta["jsonl_location"],
         )
         resp = make_response(body)
     else:
@@ -400,42 +601,84 @@ def get_raw_measurement() -> Response:
 
 
 def format_msmt_meta(msmt_meta: dict) -> dict:
-    keys = (
-        "input",
-        "measurement_start_time",
-        "measurement_uid",
-        "report_id",
-        "test_name",
-        "test_start_time",
-        "probe_asn",
-        "probe_cc",
-        "scores",
-    )
-    out = {k: msmt_meta[k] for k in keys}
-    out["category_code"] = msmt_meta.get("category_code", None)
-    out["anomaly"] = msmt_meta["anomaly"] == "t"
-    out["confirmed"] = msmt_meta["confirmed"] == "t"
-    out["failure"] = msmt_meta["msm_failure"] == "t"
-    return out
+    """Format a row fetched using _META_COLS, in place.
+    The jsonl columns, if any, are moved into "jsonl_location"
+    """
+    msmt_meta.setdefault("category_code", None)
+    msmt_meta["anomaly"] = msmt_meta["anomaly"] == "t"
+    msmt_meta["confirmed"] = msmt_meta["confirmed"] == "t"
+    msmt_meta["failure"] = msmt_meta.pop("msm_failure") == "t"
+    if "s3path" in msmt_meta:
+        cols = ("s3path", "linenum", "gz_offset", "gz_length")
+        loc = tuple(msmt_meta.pop(c) for c in cols)
+        # LEFT JOIN without a match returns '': the msmt is not in S3 yet
+        msmt_meta["jsonl_location"] = loc if loc[0] else None
+    return msmt_meta
+
+
+# Fetch only the columns used by format_msmt_meta
+_META_COLS = """input, measurement_start_time, measurement_uid, report_id,
+test_name, test_start_time, probe_asn, probe_cc, scores, anomaly, confirmed,
+msm_failure"""
+
+# Locating the jsonl file in the same query saves a round trip when
+# fetching the measurement body. The jsonl scan is restricted using
+# its primary key before the join.
+_JSONL_COLS = """jsonl.s3path AS s3path, jsonl.linenum AS linenum,
+jsonl.gz_offset AS gz_offset, jsonl.gz_length AS gz_length"""
+
+_JSONL_JOIN = """LEFT OUTER JOIN (
+    SELECT report_id, input, s3path, linenum, gz_offset, gz_length FROM jsonl
+    PREWHERE {}
+) AS jsonl ON jsonl.report_id = fastpath.report_id AND jsonl.input = fastpath.input
+"""
+
+
+def _meta_query(where: str, citizenlab: bool, jsonl_filter: Optional[str]) -> str:
+    cols = _META_COLS
+    joins = ""
+    if citizenlab:
+        # category_code is useful only for web conn
+        cols += ", citizenlab.category_code AS category_code"
+        joins += "LEFT OUTER JOIN citizenlab ON citizenlab.url = fastpath.input\n"
+    if jsonl_filter:
+        cols += ", " + _JSONL_COLS
+        joins += _JSONL_JOIN.format(jsonl_filter)
+    return f"SELECT {cols}\nFROM fastpath\n{joins}WHERE {where}\nLIMIT 1"
+
+
+# Given report_id + input, fetch measurement data from fastpath table
+# fastpath uses input = '' for empty values
+_W_RID_NOINPUT = "fastpath.report_id = %(report_id)s AND fastpath.input = ''"
+_W_RID_INPUT = "fastpath.input = %(input)s AND fastpath.report_id = %(report_id)s"
+_W_UID = "measurement_uid = %(uid)s"
+_J_UID = """(report_id, input) IN (
+        SELECT report_id, input FROM fastpath WHERE measurement_uid = %(uid)s
+    )"""
+
+# Queries indexed by with_jsonl
+_Q_META_RID_NOINPUT = (
+    _meta_query(_W_RID_NOINPUT, False, None),
+    _meta_query(_W_RID_NOINPUT, False, "report_id = %(report_id)s AND input = ''"),
+)
+_Q_META_RID_INPUT = (
+    _meta_query(_W_RID_INPUT, True, None),
+    _meta_query(_W_RID_INPUT, True, "report_id = %(report_id)s AND input = %(input)s"),
+)
+_Q_META_BY_UID = (
+    _meta_query(_W_UID, True, None),
+    _meta_query(_W_UID, True, _J_UID),
+)
 
 
 @metrics.timer("get_measurement_meta_clickhouse")
-def _get_measurement_meta_clickhouse(report_id: str, input_: Optional[str]) -> dict:
-    # Given report_id + input, fetch measurement data from fastpath table
-    query = "SELECT * FROM fastpath "
-    if input_ is None:
-        # fastpath uses input = '' for empty values
-        query += "WHERE report_id = :report_id AND input = '' "
-    else:
-        # Join citizenlab to return category_code (useful only for web conn)
-        query += """
-        LEFT OUTER JOIN citizenlab ON citizenlab.url = fastpath.input
-        WHERE fastpath.input = :input
-        AND fastpath.report_id = :report_id
-        """
+def _get_measurement_meta_clickhouse(
+    report_id: str, input_: Optional[str], with_jsonl: bool = False
+) -> dict:
+    queries = _Q_META_RID_NOINPUT if input_ is None else _Q_META_RID_INPUT
+    query = queries[with_jsonl]
     query_params = dict(input=input_, report_id=report_id)
-    query += "LIMIT 1"
-    msmt_meta = query_click_one_row(sql.text(query), query_params, query_prio=3)
+    msmt_meta = query_click_one_row(query, query_params, query_prio=3)
     if not msmt_meta:
         return {}  # measurement not found
     if msmt_meta["probe_asn"] == 0:
@@ -446,15 +689,16 @@ def _get_measurement_meta_clickhouse(report_id: str, input_: Optional[str]) -> d
     return format_msmt_meta(msmt_meta)
 
 
+# Not cached in process: scores, anomaly and confirmed can change when
+# fastpath reprocesses a measurement, and jsonl_location is None until the
+# measurement is uploaded to S3
 @metrics.timer("get_measurement_meta_by_uid")
-def _get_measurement_meta_by_uid(measurement_uid: str) -> dict:
-    query = """SELECT * FROM fastpath
-        LEFT OUTER JOIN citizenlab ON citizenlab.url = fastpath.input
-        WHERE measurement_uid = :uid
-        LIMIT 1
-    """
+def _get_measurement_meta_by_uid(
+    measurement_uid: str, with_jsonl: bool = False
+) -> dict:
     query_params = dict(uid=measurement_uid)
-    msmt_meta = query_click_one_row(sql.text(query), query_params, query_prio=3)
+    query = _Q_META_BY_UID[with_jsonl]
+    msmt_meta = query_click_one_row(query, query_params, query_prio=3)
     if not msmt_meta:
         return {}  # measurement not found
     if msmt_meta["probe_asn"] == 0:
@@ -544,12 +788,12 @@ def get_measurement_meta() -> Response:
     try:
         msmt_uid = param_measurement_uid()
         log.info(f"get_measurement_meta {msmt_uid}")
-        msmt_meta = _get_measurement_meta_by_uid(msmt_uid)
+        msmt_meta = _get_measurement_meta_by_uid(msmt_uid, full)
     except Exception:
         report_id = param_report_id()
         input_ = param_input_or_none()
         log.info(f"get_measurement_meta {report_id} {input_}")
-        msmt_meta = _get_measurement_meta_clickhouse(report_id, input_)
+        msmt_meta = _get_measurement_meta_clickhouse(report_id, input_, full)
 
     assert isinstance(msmt_meta, dict)
     if not full:
@@ -558,10 +802,14 @@ def get_measurement_meta() -> Response:
     if msmt_meta == {}:  # measurement not found
         return cachedjson("1m", raw_measurement="", **msmt_meta)
 
+    jsonl_location = msmt_meta.pop("jsonl_location")
     try:
         # TODO: uid_cleanup
         body = _fetch_measurement_body(
-            msmt_meta["report_id"], msmt_meta["input"], msmt_meta["measurement_uid"]
+            msmt_meta["report_id"],
+            msmt_meta["input"],
+            msmt_meta["measurement_uid"],
+            jsonl_location,
         )
         assert isinstance(body, bytes)
         body = body.decode()
@@ -575,6 +823,224 @@ def get_measurement_meta() -> Response:
 # # Listing measurements
 
 
+# Columns for list_measurements. Type conversions are done in ClickHouse.
+# The aliases must not shadow column names used in WHERE and ORDER BY.
+# fastpath uses input = '' for empty values: return it as None
+_LIST_COLS = [
+    sql.text("measurement_uid"),
+    sql.text("report_id"),
+    sql.text("probe_cc"),
+    sql.text("concat('AS', toString(probe_asn)) AS probe_asn_str"),
+    sql.text("test_name"),
+    sql.text("measurement_start_time"),
+    sql.text("nullIf(input, '') AS input_or_null"),
+    sql.text("toBool(fastpath.anomaly = 't') AS is_anomaly"),
+    sql.text("toBool(fastpath.confirmed = 't') AS is_confirmed"),
+    sql.text("toBool(fastpath.msm_failure = 't') AS is_failure"),
+    sql.text("scores"),
+]
+
+
+# (parameter, WHERE clause) applied when the parameter is not None
+_LIST_FILTERS = (
+    ("since", "measurement_start_time > :since"),
+    ("until", "measurement_start_time <= :until"),
+    ("report_id", "report_id = :report_id"),
+    ("probe_cc", "probe_cc = :probe_cc"),
+    ("probe_asn", "probe_asn = :probe_asn"),
+    ("test_name", "test_name = :test_name"),
+    ("software_versions", "software_version IN :software_versions"),
+    ("test_versions", "test_version IN :test_versions"),
+    ("engine_versions", "engine_version IN :engine_versions"),
+    ("input", "input = :input"),
+    ("domain", "domain = :domain"),
+    ("category_code", "citizenlab.category_code = :category_code"),
+)
+
+# Filter on anomaly, confirmed and failure:
+# The database stores anomaly and confirmed as boolean + NULL and stores
+# failures in different columns. This leads to many possible combinations
+# but only a subset is used.
+# On anomaly and confirmed: any value != TRUE is treated as FALSE
+# See test_list_measurements_filter_flags_fastpath
+# (parameter, clause if True, clause if False)
+_LIST_FLAG_FILTERS = (
+    ("anomaly", "fastpath.anomaly = 't'", "fastpath.anomaly = 'f'"),
+    ("confirmed", "fastpath.confirmed = 't'", "fastpath.confirmed = 'f'"),
+    ("failure", "fastpath.msm_failure = 't'", "fastpath.msm_failure = 'f'"),
+)
+
+
+@lru_cache(maxsize=256)
+def _build_list_measurements_query(
+    where: Tuple[str, ...], join_citizenlab: bool, order_by: str, order: str
+) -> str:
+    """Build and compile the list_measurements query once for each set of
+    filters. Limit and offset are passed as param_1 and param_2
+    """
+    fpq_table = sql.table("fastpath")
+    if join_citizenlab:
+        fpq_table = fpq_table.join(
+            sql.table("citizenlab"),
+            sql.text("citizenlab.url = fastpath.input"),
+        )
+    wexpr = and_(*(sql.text(w) for w in where))
+    fp_query = select(_LIST_COLS).where(wexpr).select_from(fpq_table)
+    ordering = "{} {}".format(order_by, order)
+    if order_by == "measurement_start_time":
+        # Tie-breaker for keyset pagination
+        ordering += ", measurement_uid {}".format(order)
+    fp_query = fp_query.order_by(text(ordering))
+
+    # Assemble the "external" query. Run a final order by followed by limit and
+    # offset
+    query = fp_query.offset(0).limit(1)
+    return str(query.compile(dialect=postgresql.dialect()))
+
+
+@lru_cache(maxsize=256)
+def _build_count_query(where: Tuple[str, ...], join_citizenlab: bool) -> str:
+    """Build the query storing the count of rows matching the filters"""
+    fpq_table = sql.table("fastpath")
+    if join_citizenlab:
+        fpq_table = fpq_table.join(
+            sql.table("citizenlab"),
+            sql.text("citizenlab.url = fastpath.input"),
+        )
+    wexpr = and_(*(sql.text(w) for w in where))
+    cols = [sql.text(":filter_hash"), sql.text("count()")]
+    q = select(cols).where(wexpr).select_from(fpq_table)
+    q = str(q.compile(dialect=postgresql.dialect()))
+    return "INSERT INTO count_cache (filter_hash, cnt) " + q
+
+
+_Q_COUNT_CACHE = """SELECT cnt, ts > now() - INTERVAL 10 MINUTE AS fresh
+FROM count_cache FINAL
+WHERE filter_hash = %(filter_hash)s"""
+
+# app.click is not thread safe: background threads use their own client
+_background_clients = threading.local()
+
+
+def _background_click(url: str) -> Clickhouse:
+    click = getattr(_background_clients, "click", None)
+    if click is None:
+        click = Clickhouse.from_url(url)
+        _background_clients.click = click
+    return click
+
+
+# Counts run in a single background thread. When too many are queued
+# new misses are not scheduled: they will be retried on later requests
+_count_executor = ThreadPoolExecutor(max_workers=1)
+_count_pending: set = set()
+_COUNT_PENDING_MAX = 8
+
+
+def _refresh_count(url: str, filter_hash: str, query: str, query_params: dict):
+    try:
+        settings = {"priority": 5, "max_execution_time": 120}
+        _background_click(url).execute(query, query_params, settings=settings)
+        metrics.incr("count_cache_refresh")
+    except Exception as e:
+        log.error(f"Failed to refresh count: {e}")
+    finally:
+        _count_pending.discard(filter_hash)
+
+
+# Fresh counts are also kept in process for a short time, to avoid a
+# count_cache lookup for each page of the same listing
+_count_memo = TTLCache(4096, 60)  # filter_hash -> cnt
+
+
+def _cached_count(
+    where: Tuple[str, ...], join_citizenlab: bool, query_params: dict
+) -> int:
+    """Return the number of rows matching the filters from count_cache,
+    or -1 if unknown. Missing or stale entries are refreshed in background
+    and stale values are served meanwhile.
+    Returns -1 unless LIST_MEASUREMENTS_COUNT_CACHE is enabled in the conf.
+    """
+    if not current_app.config.get("LIST_MEASUREMENTS_COUNT_CACHE", False):
+        return -1
+
+    key = repr((where, join_citizenlab, sorted(query_params.items())))
+    filter_hash = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    cnt = _count_memo.get(filter_hash)
+    if cnt is not None:
+        metrics.incr("count_cache_hit")
+        return cnt
+
+    row = query_click_one_row(_Q_COUNT_CACHE, dict(filter_hash=filter_hash))
+    if row and row["fresh"]:
+        metrics.incr("count_cache_hit")
+        _count_memo.set(filter_hash, row["cnt"])
+        return row["cnt"]
+
+    metrics.incr("count_cache_miss")
+    if filter_hash not in _count_pending and len(_count_pending) < _COUNT_PENDING_MAX:
+        _count_pending.add(filter_hash)
+        query = _build_count_query(where, join_citizenlab)
+        params = dict(query_params, filter_hash=filter_hash)
+        url = current_app.config["CLICKHOUSE_URL"]
+        _count_executor.submit(_refresh_count, url, filter_hash, query, params)
+
+    return row["cnt"] if row else -1
+
+
+# Clients paging through results are likely to request the next page: it
+# is fetched in background and kept for a short time, keyed by query.
+# The buffer is process-local: enable LIST_MEASUREMENTS_PREFETCH only when
+# paging clients are likely to hit the same worker.
+_prefetch_executor = ThreadPoolExecutor(max_workers=2)
+_prefetched = TTLCache(64, 60)  # key -> future
+
+
+def _prefetch_key(query: str, query_params: dict) -> str:
+    return repr((query, sorted(query_params.items())))
+
+
+def _fetch_page(url: str, query: str, query_params: dict) -> list:
+    settings = {"priority": 5, "max_execution_time": 28}
+    return _background_click(url).execute(query, query_params, settings=settings)
+
+
+def _prefetch_page(query: str, query_params: dict) -> None:
+    key = _prefetch_key(query, query_params)
+    if _prefetched.get(key) is not None:
+        return
+    url = current_app.config["CLICKHOUSE_URL"]
+    future = _prefetch_executor.submit(_fetch_page, url, query, query_params)
+    _prefetched.set(key, future)
+
+
+def _pop_prefetched_page(query: str, query_params: dict) -> Optional[list]:
+    """Return the prefetched rows, if any"""
+    future = _prefetched.pop(_prefetch_key(query, query_params))
+    if future is None:
+        return None
+    if not future.done():
+        # Querying directly is faster than waiting for the prefetch
+        metrics.incr("list_measurements_prefetch_pending")
+        return None
+    try:
+        rows = future.result()
+    except Exception as e:
+        log.info(f"Prefetch failed: {e}")
+        return None
+    metrics.incr("list_measurements_prefetch_hit")
+    return rows
+
+
+def _cursor_where(order: str) -> Tuple[str, str]:
+    op = "<" if order.lower() == "desc" else ">"
+    return (
+        # The first clause allows ClickHouse to use the primary key
+        f"measurement_start_time {op}= :cursor_time",
+        f"(measurement_start_time, measurement_uid) {op} (:cursor_time, :cursor_uid)",
+    )
+
+
 @api_msm_blueprint.route("/v1/measurements")
 @metrics.timer("list_measurements")
 def list_measurements() -> Response:
@@ -689,6 +1155,12 @@ def list_measurements() -> Response:
         in: query
         type: integer
         description: 'Number of records to return (default: 100)'
+      - name: cursor
+        in: query
+        type: string
+        description: >-
+          Opaque pagination cursor, as found in next_url. Only supported
+          when ordering by measurement_start_time
     responses:
       '200':
         description: Returns the list of measurement IDs for the specified criteria
@@ -717,6 +1189,7 @@ def list_measurements() -> Response:
     software_versions = param_commasplit("software_version")
     test_versions = param_commasplit("test_version")
     engine_versions = param_commasplit("engine_version")
+    cursor = param("cursor")
 
     # Workaround for https://github.com/ooni/probe/issues/1034
     user_agent = request.headers.get("User-Agent", "")
@@ -762,147 +1235,90 @@ def list_measurements() -> Response:
 
     # # Perform query
 
-    INULL = ""  # Special value for input = NULL to merge rows with FULL OUTER JOIN
+    if probe_cc == "ZZ":
+        log.info("Refusing list_measurements with probe_cc set to ZZ")
+        abort(403)
 
-    ## Create fastpath columns for query
-    # TODO cast scores, coalesce input as ""
-    fpwhere = []
-    query_params: Dict[str, Any] = {}
+    if probe_asn == 0:
+        log.info("Refusing list_measurements with probe_asn set to 0")
+        abort(403)
 
     # Populate WHERE clauses and query_params dict
+    values = dict(
+        since=since,
+        until=until,
+        report_id=report_id or None,
+        probe_cc=probe_cc or None,
+        probe_asn=probe_asn,
+        test_name=test_name,
+        software_versions=software_versions,
+        test_versions=test_versions,
+        engine_versions=engine_versions,
+        input=input_ or None,
+        # input_ overrides domain and category_code
+        # both domain and category_code can be set at the same time
+        domain=None if input_ else domain or None,
+        category_code=None if input_ else category_code or None,
+    )
+    fpwhere = []
+    query_params: Dict[str, Any] = {}
+    for name, clause in _LIST_FILTERS:
+        v = values[name]
+        if v is not None:
+            fpwhere.append(clause)
+            query_params[name] = v
 
-    if since is not None:
-        query_params["since"] = since
-        fpwhere.append(sql.text("measurement_start_time > :since"))
-
-    if until is not None:
-        query_params["until"] = until
-        fpwhere.append(sql.text("measurement_start_time <= :until"))
-
-    if report_id:
-        query_params["report_id"] = report_id
-        fpwhere.append(sql.text("report_id = :report_id"))
+    if values["probe_cc"] is None:
+        fpwhere.append("probe_cc != 'ZZ'")
 
-    if probe_cc:
-        if probe_cc == "ZZ":
-            log.info("Refusing list_measurements with probe_cc set to ZZ")
-            abort(403)
-        query_params["probe_cc"] = probe_cc
-        fpwhere.append(sql.text("probe_cc = :probe_cc"))
-    else:
-        fpwhere.append(sql.text("probe_cc != 'ZZ'"))
-
-    if probe_asn is not None:
-        if probe_asn == 0:
-            log.info("Refusing list_measurements with probe_asn set to 0")
-            abort(403)
-        query_params["probe_asn"] = probe_asn
-        fpwhere.append(sql.text("probe_asn = :probe_asn"))
-    else:
+    if probe_asn is None:
         # https://ooni.org/post/2020-ooni-probe-asn-incident-report/
         # https://github.com/ooni/explorer/issues/495
-        fpwhere.append(sql.text("probe_asn != 0"))
-
-    if test_name is not None:
-        query_params["test_name"] = test_name
-        fpwhere.append(sql.text("test_name = :test_name"))
-
-    if software_versions is not None:
-        query_params["software_versions"] = software_versions
-        fpwhere.append(sql.text("software_version IN :software_versions"))
-
-    if test_versions is not None:
-        query_params["test_versions"] = test_versions
-        fpwhere.append(sql.text("test_version IN :test_versions"))
-
-    if engine_versions is not None:
-        query_params["engine_versions"] = engine_versions
-        fpwhere.append(sql.text("engine_version IN :engine_versions"))
-
-    # Filter on anomaly, confirmed and failure:
-    # The database stores anomaly and confirmed as boolean + NULL and stores
-    # failures in different columns. This leads to many possible combinations
-    # but only a subset is used.
-    # On anomaly and confirmed: any value != TRUE is treated as FALSE
-    # See test_list_measurements_filter_flags_fastpath
-
-    if anomaly is True:
-        fpwhere.append(sql.text("fastpath.anomaly = 't'"))
-
-    elif anomaly is False:
-        fpwhere.append(sql.text("fastpath.anomaly = 'f'"))
-
-    if confirmed is True:
-        fpwhere.append(sql.text("fastpath.confirmed = 't'"))
-
-    elif confirmed is False:
-        fpwhere.append(sql.text("fastpath.confirmed = 'f'"))
-
-    if failure is True:
-        fpwhere.append(sql.text("fastpath.msm_failure = 't'"))
-
-    elif failure is False:
-        fpwhere.append(sql.text("fastpath.msm_failure = 'f'"))
+        fpwhere.append("probe_asn != 0")
 
-    fpq_table = sql.table("fastpath")
-
-    if input_:
-        # input_ overrides domain and category_code
-        query_params["input"] = input_
-        fpwhere.append(sql.text("input = :input"))
-
-    elif domain or category_code:
-        # both domain and category_code can be set at the same time
-        if domain:
-            query_params["domain"] = domain
-            fpwhere.append(sql.text("domain = :domain"))
-
-        if category_code:
-            query_params["category_code"] = category_code
-            fpq_table = fpq_table.join(
-                sql.table("citizenlab"),
-                sql.text("citizenlab.url = fastpath.input"),
-            )
-            fpwhere.append(sql.text("citizenlab.category_code = :category_code"))
+    flags = dict(anomaly=anomaly, confirmed=confirmed, failure=failure)
+    for name, if_true, if_false in _LIST_FLAG_FILTERS:
+        v = flags[name]
+        if v is True:
+            fpwhere.append(if_true)
+        elif v is False:
+            fpwhere.append(if_false)
 
-    fp_query = select("*").where(and_(*fpwhere)).select_from(fpq_table)
+    join_citizenlab = values["category_code"] is not None
 
     if order_by is None:
         order_by = "measurement_start_time"
 
-    fp_query = fp_query.order_by(text("{} {}".format(order_by, order)))
-
-    # Assemble the "external" query. Run a final order by followed by limit and
-    # offset
-    query = fp_query.offset(offset).limit(limit)
-    query_params["param_1"] = limit
-    query_params["param_2"] = offset
+    # Keyset pagination: seek after the last row of the previous page instead
+    # of scanning and discarding `offset` rows. The offset parameter is still
+    # used to report current_page.
+    keyset = order_by == "measurement_start_time"
+    count_where = tuple(fpwhere)
+    count_params = dict(query_params)
+    if cursor:
+        if not keyset:
+            raise BadRequest("cursor requires ordering by measurement_start_time")
+        cursor_time, cursor_uid = _decode_cursor(cursor)
+        fpwhere.extend(_cursor_where(order))
+        query_params["cursor_time"] = cursor_time
+        query_params["cursor_uid"] = cursor_uid
+
+    where = tuple(fpwhere)
+    query = _build_list_measurements_query(where, join_citizenlab, order_by, order)
+    # Fetch one extra row to detect if there is a next page
+    query_params["param_1"] = limit + 1
+    query_params["param_2"] = 0 if cursor else offset
 
     # Run the query, generate the results list
     iter_start_time = time.time()
 
+    prefetch = current_app.config.get("LIST_MEASUREMENTS_PREFETCH", False)
     try:
-        rows = query_click(query, query_params)
-        results = []
-        for row in rows:
-            msmt_uid = row["measurement_uid"]
-            url = genurl("/api/v1/raw_measurement", measurement_uid=msmt_uid)
-            results.append(
-                {
-                    "measurement_uid": msmt_uid,
-                    "measurement_url": url,
-                    "report_id": row["report_id"],
-                    "probe_cc": row["probe_cc"],
-                    "probe_asn": "AS{}".format(row["probe_asn"]),
-                    "test_name": row["test_name"],
-                    "measurement_start_time": row["measurement_start_time"],
-                    "input": row["input"],
-                    "anomaly": row["anomaly"] == "t",
-                    "confirmed": row["confirmed"] == "t",
-                    "failure": row["msm_failure"] == "t",
-                    "scores": json.loads(row["scores"]),
-                }
-            )
+        rows = _pop_prefetched_page(query, query_params) if prefetch else None
+        if rows is None:
+            # Explorer pagination and dashboards repeat the same queries
+            settings = query_cache_settings(60, min_query_runs=2)
+            rows = query_click_tuples(query, query_params, settings=settings)
     except OperationalError as exc:
         log.error(exc)
         if isinstance(exc.orig, QueryCanceledError):
@@ -913,31 +1329,80 @@ def list_measurements() -> Response:
 
         raise exc
 
-    # Replace the special value INULL for "input" with None
-    for i, r in enumerate(results):
-        if r["input"] == INULL:
-            results[i]["input"] = None
+    has_next = len(rows) > limit
+    del rows[limit:]
+
+    # measurement_uid contains only URL-safe chars: skip urlencode
+    url_prefix = genurl("/api/v1/raw_measurement", measurement_uid="")
+    # Columns in _LIST_COLS order
+    results = [
+        {
+            "measurement_uid": uid,
+            "measurement_url": url_prefix + uid
+            if _url_safe.match(uid)
+            else genurl("/api/v1/raw_measurement", measurement_uid=uid),
+            "report_id": rid,
+            "probe_cc": cc,
+            "probe_asn": asn,
+            "test_name": tname,
+            "measurement_start_time": mst,
+            "input": inp,
+            "anomaly": is_anomaly,
+            "confirmed": is_confirmed,
+            "failure": is_failure,
+            "scores": ujson.loads(scores),
+        }
+        for (
+            uid,
+            rid,
+            cc,
+            asn,
+            tname,
+            mst,
+            inp,
+            is_anomaly,
+            is_confirmed,
+            is_failure,
+            scores,
+        ) in rows
+    ]
 
     pages = -1
     count = -1
     current_page = math.ceil(offset / limit) + 1
 
-    # We got less results than what we expected, we know the count and that
-    # we are done
-    if len(results) < limit:
-        count = offset + len(results)
+    # This is the last page: we know the count and that we are done
+    if not has_next:
+        count = offset + len(rows)
         pages = math.ceil(count / limit)
         next_url = None
     else:
-        # XXX this is too intensive. find a workaround
-        # count_start_time = time.time()
-        # count = q.count()
-        # pages = math.ceil(count / limit)
-        # current_page = math.ceil(offset / limit) + 1
-        # query_time += time.time() - count_start_time
+        # Counting is too intensive to be done for each request
+        count = _cached_count(count_where, join_citizenlab, count_params)
+        if count != -1:
+            pages = math.ceil(count / limit)
         next_args = request.args.to_dict()
         next_args["offset"] = str(offset + limit)
         next_args["limit"] = str(limit)
+        if keyset:
+            # Columns in _LIST_COLS order
+            last = rows[limit - 1]
+            next_args["cursor"] = _encode_cursor(last[5], last[0])
+            if cursor and prefetch:
+                # The client is paging through results: prefetch the next
+                # page using the same query the next request will build
+                next_where = count_where + _cursor_where(order)
+                next_query = _build_list_measurements_query(
+                    next_where, join_citizenlab, order_by, order
+                )
+                next_params = dict(
+                    count_params,
+                    cursor_time=last[5],
+                    cursor_uid=last[0],
+                    param_1=limit + 1,
+                    param_2=0,
+                )
+                _prefetch_page(next_query, next_params)
         next_url = genurl("/api/v1/measurements", **next_args)
 
     query_time = time.time() - iter_start_time
@@ -950,7 +1415,7 @@ def list_measurements() -> Response:
         "next_url": next_url,
         "query_time": query_time,
     }
-    return cachedjson("1m", metadata=metadata, results=results[:limit])
+    return cachedjson("1m", metadata=metadata, results=results)
 
 
 def set_dload(resp, fname: str):
@@ -958,6 +1423,44 @@ def set_dload(resp, fname: str):
     resp.headers["Content-Disposition"] = f"attachment; filename={fname}"
 
 
+def _torsf_stats_query(has_cc: bool, has_since: bool, has_until: bool) -> str:
+    where = ["test_name = 'torsf'"]
+    if has_cc:
+        where.append("probe_cc = %(probe_cc)s")
+    if has_since:
+        where.append("measurement_start_time > %(since)s")
+    if has_until:
+        where.append("measurement_start_time <= %(until)s")
+    where_expr = " AND ".join(where)
+    return f"""SELECT toDate(measurement_start_time) AS measurement_start_day,
+    probe_cc,
+    countIf(anomaly = 't') AS anomaly_count,
+    countIf(confirmed = 't') AS confirmed_count,
+    countIf(msm_failure = 't') AS failure_count,
+    count() AS measurement_count,
+    anomaly_count / measurement_count AS anomaly_rate
+FROM fastpath
+WHERE {where_expr}
+GROUP BY measurement_start_day, probe_cc
+ORDER BY measurement_start_day, probe_cc"""
+
+
+# torsf_stats queries for each combination of (probe_cc, since, until) set
+_TORSF_SQL = {
+    flags: _torsf_stats_query(*flags) for flags in product((False, True), repeat=3)
+}
+
+
+@ttl_cache("torsf_cacheable_cutoff", 1, 60)
+def _torsf_cacheable_cutoff() -> datetime:
+    """Return the start of the day 72h ago: torsf_stats responses for
+    data older than that can be cached. Snapping to the day keeps the
+    cacheability stable for equivalent requests through the day.
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(hours=72)
+
+
 @api_msm_blueprint.route("/v1/torsf_stats")
 @metrics.timer("get_torsf_stats")
 def get_torsf_stats() -> Response:
@@ -993,46 +1496,26 @@ def get_torsf_stats() -> Response:
     since = param("since")
     until = param("until")
     cacheable = False
-
-    cols = [
-        sql.text("toDate(measurement_start_time) AS measurement_start_day"),
-        column("probe_cc"),
-        sql.text("countIf(anomaly = 't') AS anomaly_count"),
-        sql.text("countIf(confirmed = 't') AS confirmed_count"),
-        sql.text("countIf(msm_failure = 't') AS failure_count"),
-    ]
-    table = sql.table("fastpath")
-    where = [sql.text("test_name = 'torsf'")]
     query_params: Dict[str, Any] = {}
 
     if probe_cc:
-        where.append(sql.text("probe_cc = :probe_cc"))
         query_params["probe_cc"] = probe_cc
 
     if since:
-        where.append(sql.text("measurement_start_time > :since"))
-        query_params["since"] = str(parse_date(since))
+        query_params["since"] = parse_date(since)
 
     if until:
         until_td = parse_date(until)
-        where.append(sql.text("measurement_start_time <= :until"))
-        query_params["until"] = str(until_td)
-        cacheable = until_td < datetime.now() - timedelta(hours=72)
-
-    # Assemble query
-    where_expr = and_(*where)
-    query = select(cols).where(where_expr).select_from(table)
+        query_params["until"] = until_td
+        cacheable = until_td < _torsf_cacheable_cutoff()
 
-    query = query.group_by(column("measurement_start_day"), column("probe_cc"))
-    query = query.order_by(column("measurement_start_day"), column("probe_cc"))
+    query = _TORSF_SQL[(bool(probe_cc), bool(since), bool(until))]
 
+    # Only the slow aggregations are worth caching. Past data does not change.
+    ttl = 3600 * 24 if cacheable else 3600
+    settings = query_cache_settings(ttl, min_query_duration=500)
     try:
-        q = query_click(query, query_params)
-        result = []
-        for row in q:
-            row = dict(row)
-            row["anomaly_rate"] = row["anomaly_count"] / row["measurement_count"]
-            result.append(row)
+        result = query_click(query, query_params, settings=settings)
         response = jsonify({"v": 0, "result": result})
         if cacheable:
             response.cache_control.max_age = 3600 * 24
@@ -1060,23 +1543,37 @@ ORDER BY (measurement_uid, account_id)
 SETTINGS index_granularity = 4
 """
 
-valid_feedback_status = [
-    "blocked",
-    "blocked.blockpage",
-    "blocked.blockpage.http",
-    "blocked.blockpage.dns",
-    "blocked.blockpage.server_side",
-    "blocked.blockpage.server_side.captcha",
-    "blocked.dns",
-    "blocked.dns.inconsistent",
-    "blocked.dns.nxdomain",
-    "blocked.tcp",
-    "blocked.tls",
-    "ok",
-    "down",
-    "down.unreachable",
-    "down.misconfigured",
-]
+valid_feedback_status = frozenset(
+    {
+        "blocked",
+        "blocked.blockpage",
+        "blocked.blockpage.http",
+        "blocked.blockpage.dns",
+        "blocked.blockpage.server_side",
+        "blocked.blockpage.server_side.captcha",
+        "blocked.dns",
+        "blocked.dns.inconsistent",
+        "blocked.dns.nxdomain",
+        "blocked.tcp",
+        "blocked.tls",
+        "ok",
+        "down",
+        "down.unreachable",
+        "down.misconfigured",
+    }
+)
+
+
+# Aggregate into a single row: summary is returned as (statuses, counts)
+# The latest status for each account is picked with argMax instead of FINAL
+_Q_MSMT_FEEDBACK = """SELECT sumMap([status], [toUInt64(1)]) AS summary,
+    anyIf(status, account_id = %(aid)s) AS user_feedback
+FROM (
+    SELECT account_id, argMax(status, update_time) AS status
+    FROM msmt_feedback
+    WHERE measurement_uid = %(muid)s
+    GROUP BY account_id
+)"""
 
 
 @api_msm_blueprint.route("/_/measurement_feedback/<measurement_uid>")
@@ -1098,19 +1595,18 @@ def get_msmt_feedback(measurement_uid) -> Response:
         description: status summary
     """
     account_id = get_account_id_or_none()
-    query = """SELECT status, account_id = :aid AS is_mine, count() AS cnt
-        FROM msmt_feedback FINAL
-        WHERE measurement_uid = :muid
-        GROUP BY status, is_mine
-    """
-    qp = dict(aid=account_id, muid=measurement_uid)
-    rows = query_click(sql.text(query), qp)
+    # Avoid a NULL condition in anyIf for anonymous users
+    qp = dict(aid=account_id or "", muid=measurement_uid)
+    row = query_click_one_row(_Q_MSMT_FEEDBACK, qp)
     out: Dict[str, Any] = dict(summary={})
-    for row in rows:
-        status = row["status"]
-        if row["is_mine"]:
-            out["user_feedback"] = status
-        out["summary"][status] = out["summary"].get(status, 0) + row["cnt"]
+    if row is None:
+        # Not expected: aggregation without GROUP BY always returns a row
+        return cachedjson("0s", **out)
+
+    statuses, counts = row["summary"]
+    out["summary"] = dict(zip(statuses, counts))
+    if row["user_feedback"]:
+        out["user_feedback"] = row["user_feedback"]
 
     return cachedjson("0s", **out)
 
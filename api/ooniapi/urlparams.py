@@ -3,6 +3,7 @@ URL parameter parsers
 """
 
 from datetime import datetime
+from functools import lru_cache
 from dateutil.parser import parse as parse_date
 from flask import request
 from ipaddress import ip_address as parse_ip_address
@@ -15,13 +16,18 @@ import string
 ostr = Optional[str]
 
 
+@lru_cache(maxsize=None)
+def _charset_matcher(accepted: str):
+    """Compile a regexp matching strings made only of <accepted> chars"""
+    return re.compile("[" + re.escape(accepted) + "]*").fullmatch
+
+
 def validate(item: ostr, accepted: str) -> None:
     """Ensure item contains only valid chars or is None"""
     if item is None:
         return
-    for c in item:
-        if c not in accepted:
-            raise ValueError("Invalid characters")
+    if not _charset_matcher(accepted)(item):
+        raise ValueError("Invalid characters")
 
 
 def param_asn(name: str) -> Optional[int]:
@@ -159,16 +165,19 @@ def param_report_id() -> str:
     return rid
 
 
+_input_matcher = _charset_matcher(
+    string.ascii_letters + string.digits + r" :/.[]-_%+(){}=?#&!,$"
+)
+
+
 def param_input_or_none() -> Optional[str]:
     """Accepts any input format supported or None"""
     p = request.args.get("input")
     if not p:
         return None
     x = p.encode("ascii", "ignore").decode()
-    accepted = string.ascii_letters + string.digits + r" :/.[]-_%+(){}=?#&!,$"
-    for c in x:
-        if c not in accepted:
-            raise ValueError("Invalid characters in input field")
+    if not _input_matcher(x):
+        raise ValueError("Invalid characters in input field")
     return p
 
 
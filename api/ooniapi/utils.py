@@ -1,14 +1,20 @@
+from collections import OrderedDict
 from csv import DictWriter
 from datetime import datetime
+from functools import wraps
 from io import StringIO
 from os import urandom
 from sys import byteorder
+from typing import Optional
+import time
 
 from flask import request, make_response, Response
 from flask.json import jsonify
 
 import ujson
 
+from ooniapi.config import metrics
+
 ISO_TIMESTAMP_SHORT = "%Y%m%dT%H%M%SZ"
 OONI_EPOCH = datetime(2012, 12, 5)
 
@@ -69,9 +75,81 @@ def req_json():
 
 
 def generate_random_intuid(current_app) -> int:
+    """Generate a random ID with a single urandom call.
+    The last 2 decimal digits are the collector ID.
+    """
     try:
         collector_id = int(current_app.config["COLLECTOR_ID"])
     except ValueError:
         collector_id = 0
     randint = int.from_bytes(urandom(4), byteorder)
     return randint * 100 + collector_id
+
+
+class TTLCache:
+    """Process-local dict with per-entry expiry and LRU eviction.
+    Not thread safe.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (monotonic expiry, value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        hit = self._data.get(key)
+        if hit is None:
+            return default
+        expiry, value = hit
+        if expiry < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        hit = self._data.pop(key, None)
+        if hit is None or hit[0] < time.monotonic():
+            return default
+        return hit[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+def ttl_cache(name: str, maxsize: int, ttl: int, max_item_size: Optional[int] = None):
+    """Process-local LRU cache with expiry, keyed by positional arguments.
+    Exceptions and falsy results are not cached. Values larger than
+    max_item_size are not cached.
+    Emits <name>_cache_hit and <name>_cache_miss counters.
+    """
+
+    def decorator(func):
+        cache = TTLCache(maxsize, ttl)
+
+        @wraps(func)
+        def wrapper(*args):
+            value = cache.get(args)
+            if value is not None:
+                metrics.incr(f"{name}_cache_hit")
+                return value
+
+            metrics.incr(f"{name}_cache_miss")
+            value = func(*args)
+            if value and (max_item_size is None or len(value) <= max_item_size):
+                cache.set(args, value)
+            return value
+
+        wrapper.cache_clear = cache.clear  # type: ignore
+        return wrapper
+
+    return decorator
@@ -2,11 +2,13 @@ from datetime import date, timedelta
 from pathlib import Path
 from textwrap import dedent
 from typing import List
+import os
 import subprocess
 
 import pytest
 import flask
 from clickhouse_driver import Client as Clickhouse
+from filelock import FileLock
 
 # Setup logging before doing anything with the Flask app
 # See README.adoc
@@ -28,15 +30,23 @@ def app():
     return app
 
 
-@pytest.yield_fixture
-def client(app):
+@pytest.fixture(scope="session")
+def session_client(app):
+    """Test client shared across the whole test session"""
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def client(session_client):
     """
     Overriding the `client` fixture from pytest_flask to fix this bug:
     https://github.com/pytest-dev/pytest-flask/issues/42
+    The client is reused: cookies are cleared after each test
     """
-    with app.test_client() as client:
-        yield client
+    yield session_client
 
+    session_client.cookie_jar.clear()
     while True:
         top = flask._request_ctx_stack.top
         if top is not None and top.preserved:
@@ -153,12 +163,27 @@ def run_fastpath(log, repo_dir: Path, clickhouse_url: str) -> None:
 
 
 @pytest.fixture(autouse=True, scope="session")
-def setup_database(app):
+def setup_database(app, tmp_path_factory):
     # Create tables, indexes and so on
     # This part needs the "app" object
     if not pytest.create_db:
         return
 
+    if "PYTEST_XDIST_WORKER" not in os.environ:
+        _setup_database(app)
+        return
+
+    # Running under pytest-xdist: each worker runs session fixtures.
+    # Populate the DB only once, other workers wait for it.
+    shared = tmp_path_factory.getbasetemp().parent
+    with FileLock(str(shared / "setup_database.lock")):
+        done = shared / "setup_database.done"
+        if not done.exists():
+            _setup_database(app)
+            done.touch()
+
+
+def _setup_database(app):
     clickhouse_url = app.config["CLICKHOUSE_URL"]
     assert any([x in clickhouse_url for x in ("localhost", "clickhouse")])
     log = app.logger
@@ -37,7 +37,8 @@ CREATE TABLE default.fastpath
     `engine_version` String,
     `blocking_type` String,
     `test_helper_address` LowCardinality(String),
-    `test_helper_type` LowCardinality(String)
+    `test_helper_type` LowCardinality(String),
+    INDEX fastpath_domain_idx domain TYPE bloom_filter GRANULARITY 4
 )
 ENGINE = ReplacingMergeTree
 ORDER BY (measurement_start_time, report_id, input)
@@ -49,7 +50,9 @@ CREATE TABLE default.jsonl
     `input` String,
     `s3path` String,
     `linenum` Int32,
-    `measurement_uid` String
+    `measurement_uid` String,
+    `gz_offset` UInt64 DEFAULT 0,
+    `gz_length` UInt32 DEFAULT 0
 )
 ENGINE = MergeTree
 ORDER BY (report_id, input)
@@ -168,6 +171,16 @@ ENGINE = ReplacingMergeTree
 ORDER BY (measurement_uid, account_id)
 SETTINGS index_granularity = 4;
 
+CREATE TABLE default.count_cache
+(
+    `filter_hash` String,
+    `cnt` UInt64,
+    `ts` DateTime DEFAULT now()
+)
+ENGINE = ReplacingMergeTree(ts)
+ORDER BY filter_hash
+TTL ts + INTERVAL 1 DAY;
+
 CREATE TABLE default.fingerprints_dns
 (
     `name` String,
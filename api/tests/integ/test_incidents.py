@@ -23,7 +23,7 @@ def cleanup(adminsession):
     assert r.status_code == 200, r.json
     assert "incidents" in r.json
     for i in r.json["incidents"]:
-        if i["title"] not in ("integ-test-1", "integ-test-2"):
+        if not i["title"].startswith("integ-test"):
             continue
         if i["reported_by"] != "ooni":
             continue
@@ -282,6 +282,38 @@ def test_crud_user_create_invalid_dates(cleanup, client, adminsession, usersessi
     assert r.status_code == 400, r.json
 
 
+@pytest.mark.parametrize(
+    "start_time",
+    [
+        "2020-01-01T00:00:00+01:00Z",
+        "2020-01-01Z",
+        "2020-01-01T00:00:00.5Z",
+        "2020-01-01T00:00:00",
+    ],
+)
+def test_crud_user_create_invalid_timestamp(
+    cleanup, client, adminsession, usersession, start_time
+):
+    new = dict(
+        start_time=start_time,
+        end_time="2020-01-02T00:00:00Z",
+        reported_by="ooni",
+        title="integ-test-6",
+        short_description="integ test",
+        text="foo bar\nbaz\n",
+        event_type="incident",
+        published=False,
+        CCs=["UK", "FR"],
+        test_names=["web_connectivity"],
+        ASNs=[1, 2],
+        domains=[],
+        tags=["integ-test"],
+        links=[],
+    )
+    r = usersession.post("/api/v1/incidents/create", json=new)
+    assert r.status_code == 400, r.json
+
+
 def test_crud_invalid_fields(client, adminsession, usersession):
     # Create
     new = dict(
@@ -329,3 +361,85 @@ def test_crud_extra_field(client, adminsession, usersession):
     d = dict(new_entry=new)
     r = adminsession.post("/api/v1/incidents/update", json=d)
     assert r.status_code == 400, r.json
+
+
+def test_search_paging(cleanup, client, usersession):
+    for n in (1, 2, 3):
+        new = dict(
+            start_time="2020-01-01T00:00:00Z",
+            end_time=None,
+            reported_by="ooni",
+            title=f"integ-test-paging-{n}",
+            short_description="integ test",
+            text="foo bar\nbaz\n",
+            event_type="incident",
+            published=False,
+            CCs=["UK", "FR"],
+            test_names=["web_connectivity"],
+            ASNs=[1, 2],
+            domains=[],
+            tags=["integ-test"],
+            links=[],
+        )
+        r = usersession.post("/api/v1/incidents/create", json=new)
+        assert r.status_code == 200, r.json
+
+    def titles(args):
+        r = usersession.get(f"/api/v1/incidents/search?only_mine=True&{args}")
+        assert r.status_code == 200, r.json
+        return [i["title"] for i in r.json["incidents"]]
+
+    assert titles("") == [f"integ-test-paging-{n}" for n in (1, 2, 3)]
+    assert titles("limit=1&offset=1") == ["integ-test-paging-2"]
+    # OFFSET without LIMIT
+    assert titles("offset=2") == ["integ-test-paging-3"]
+
+
+@pytest.mark.parametrize("args", ["limit=-1", "offset=-1", "limit=foo"])
+def test_search_invalid_paging(client, args):
+    r = client.get(f"/api/v1/incidents/search?{args}")
+    assert r.status_code == 400, r.json
+
+
+def test_crud_user_ownership(cleanup, client, adminsession, usersession):
+    new = dict(
+        start_time="2020-01-01T00:00:00Z",
+        end_time=None,
+        reported_by="ooni",
+        title="integ-test-1",
+        short_description="integ test",
+        text="foo bar\nbaz\n",
+        event_type="incident",
+        published=False,
+        CCs=["UK", "FR"],
+        test_names=["web_connectivity"],
+        ASNs=[1, 2],
+        domains=[],
+        tags=["integ-test"],
+        links=[],
+    )
+    r = adminsession.post("/api/v1/incidents/create", json=dict(**new))
+    assert r.status_code == 200, r.json
+    incident_id = r.json["id"]
+
+    # Writes by a non-owner are rejected and leave the incident unchanged
+    new["id"] = incident_id
+    new["title"] = "integ-test-2"
+    r = usersession.post("/api/v1/incidents/update", json=dict(**new))
+    assert r.status_code == 400, r.json
+    assert r.json["err_str"] == "err_ownership"
+    # The ownership error takes precedence over the publishing one
+    r = usersession.post("/api/v1/incidents/update", json=dict(new, published=True))
+    assert r.status_code == 400, r.json
+    assert r.json["err_str"] == "err_ownership"
+    r = usersession.post("/api/v1/incidents/delete", json=dict(id=incident_id))
+    assert r.status_code == 400, r.json
+    assert r.json["err_str"] == "err_ownership"
+
+    r = adminsession.get(f"/api/v1/incidents/show/{incident_id}")
+    assert r.status_code == 200, r.json
+    assert r.json["incident"]["title"] == "integ-test-1"
+
+    # Deleting a missing incident is a no-op, not an ownership error
+    r = usersession.post("/api/v1/incidents/delete", json=dict(id="999999999"))
+    assert r.status_code == 200, r.json
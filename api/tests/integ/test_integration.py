@@ -25,51 +25,59 @@ from ooniapi.measurements import FASTPATH_MSM_ID_PREFIX
 # The flask app is created in tests/conftest.py
 
 
-@pytest.fixture()
-def fastpath_dup_rid_input(app):
-    """
-    Access DB directly. Fetch > 1 measurements from fastpath that share the same
-    report_id and input
-    Returns (rid, input, count)
-    """
-    # Too slow
-    sql = """
-    SELECT report_id, input
-    from fastpath
-    group by report_id, input
-    HAVING count(*) > 1
+# Pick all the sample measurements needed by the fixtures in one query
+_SAMPLE_ROWS_SQL = """
+SELECT 'fresh' AS kind, report_id, input, test_start_time FROM (
+    SELECT report_id, input, test_start_time FROM fastpath
+    WHERE input != ''
+    ORDER BY measurement_start_time DESC
     LIMIT 1
+)
+UNION ALL
+SELECT 'dup' AS kind, report_id, input, test_start_time FROM (
+    SELECT report_id, input, min(test_start_time) AS test_start_time
+    FROM fastpath
+    GROUP BY report_id, input
+    HAVING count() > 1
+    LIMIT 1
+    -- Stop tracking new (report_id, input) keys once the hash table is
+    -- large: one duplicate is enough
+    SETTINGS max_rows_to_group_by = 100000, group_by_overflow_mode = 'any'
+)
+"""
+
+
+@pytest.fixture(scope="session")
+def sample_rows(app):
+    """Access DB directly.
+    Returns {kind: (report_id, input, test_start_time)}
     """
-    with app.app_context():
-        for row in app.db_session.execute(sql):
-            return (row[0], row[1])
+    rows = app.click.execute(_SAMPLE_ROWS_SQL)
+    return {kind: (rid, inp, tst) for kind, rid, inp, tst in rows}
 
 
 @pytest.fixture()
-def fastpath_rid_input(app):
-    """Access DB directly. Get a fresh msmt
+def fastpath_dup_rid_input(sample_rows):
+    """
+    Fetch > 1 measurements from fastpath that share the same
+    report_id and input
     Returns (rid, input)
     """
-    sql = """
-    SELECT report_id, input, test_start_time FROM fastpath
-    WHERE input IS NOT NULL
-    ORDER BY measurement_start_time DESC
-    LIMIT 1
+    return sample_rows["dup"][:2]
+
+
+@pytest.fixture()
+def fastpath_rid_input(sample_rows):
+    """Get a fresh msmt
+    Returns (rid, input, test_start_time)
     """
-    rid, inp, test_start_time = dbquery(app, sql)[0:3]
+    rid, inp, test_start_time = sample_rows["fresh"]
     assert rid.strip()
     assert inp.strip()
 
     return (rid, inp, test_start_time)
 
 
-def dbquery(app, sql, **query_params):
-    """Access DB directly, returns row as tuple."""
-    with app.app_context():
-        q = app.db_session.execute(sql, query_params)
-        return q.fetchone()
-
-
 def api(client, subpath, **kw):
     url = f"/api/v1/{subpath}"
     if kw:
@@ -189,6 +197,17 @@ def test_redirects_and_rate_limit_spin_to_zero_unmetered(client, lower_rate_limi
 
 # # list_files # #
 
+EXPECTED_FILE_KEYS = frozenset(
+    {
+        "download_url",
+        "index",
+        "probe_asn",
+        "probe_cc",
+        "test_name",
+        "test_start_time",
+    }
+)
+
 
 @pytest.mark.skip(reason="DROP")
 def test_list_files_pagination(client):
@@ -196,14 +215,7 @@ def test_list_files_pagination(client):
     ret = api(client, url)
     results = ret["results"]
     assert len(results) == 1
-    assert sorted(results[0].keys()) == [
-        "download_url",
-        "index",
-        "probe_asn",
-        "probe_cc",
-        "test_name",
-        "test_start_time",
-    ]
+    assert results[0].keys() == EXPECTED_FILE_KEYS
     assert ret["metadata"] == {
         "count": 13273,
         "current_page": 1,
@@ -593,34 +605,25 @@ def test_list_measurements_slow_order_by_group_3(f1, f2, log, client):
     response = api(client, url)
 
 
-def test_list_measurements_pagination_old(client, log):
-    # Ensure answers stay consistent across calls - using old data
+@pytest.mark.parametrize("fresh", (False, True), ids=("old", "new"))
+def test_list_measurements_pagination(client, log, fresh, today_range):
+    # Ensure answers stay consistent across calls - using old or fresh data
     # https://github.com/ooni/api/issues/49
-    url = "measurements?probe_cc=RU&test_name=web_connectivity&limit=100&offset=5000&since=2018-12-24&until=2018-12-25"
-    j = None
-    for n in range(3):
-        log.info(f"{'-' * 20} Cycle {n} {'-' * 20}")
-        new = api(client, url)
-        del new["metadata"]["query_time"]
-        if j is not None:
-            assert j == new
-        j = new
-
-
-def test_list_measurements_pagination_new(client, log):
-    # Ensure answers stay consistent across calls - using fresh data
-    # https://github.com/ooni/api/issues/49
-    since = (datetime.utcnow().date() - timedelta(days=1)).strftime("%Y-%m-%d")
-    until = datetime.utcnow().date().strftime("%Y-%m-%d")
+    # The calls are sequential on purpose: app.click is not thread safe
+    if fresh:
+        until, since, _ = today_range
+    else:
+        since, until = "2018-12-24", "2018-12-25"
     url = f"measurements?probe_cc=RU&test_name=web_connectivity&limit=100&offset=5000&since={since}&until={until}"
-    j = None
+    responses = []
     for n in range(3):
         log.info(f"{'-' * 20} Cycle {n} {'-' * 20}")
         new = api(client, url)
         del new["metadata"]["query_time"]
-        if j is not None:
-            assert j == new
-        j = new
+        responses.append(new)
+
+    assert responses[1] == responses[0]
+    assert responses[2] == responses[0]
 
 
 def test_list_measurements_arbitrary_test_name(client):
@@ -639,11 +642,15 @@ def test_list_measurements_arbitrary_test_name(client):
     }
 
 
+@pytest.fixture(scope="session")
 def today_range():
-    """Return since/until pair to extract fresh fastpath entries"""
-    since = datetime.utcnow().date()
-    until = since + timedelta(days=1)
-    return since, until
+    """Return today, yesterday and tomorrow as YYYY-MM-DD strings,
+    used to extract fresh fastpath entries
+    """
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
+    tomorrow = today + timedelta(days=1)
+    return today.isoformat(), yesterday.isoformat(), tomorrow.isoformat()
 
 
 @pytest.mark.parametrize("anomaly", (True, False))
@@ -692,19 +699,29 @@ def test_list_measurements_probe_asn(client):
         assert r["probe_asn"] == "AS5089"
 
 
-def test_list_measurements_failure_true_fastpath(client):
-    p = f"measurements?failure=true&since=2021-07-09&until=2021-07-10&limit=50"
-    response = api(client, p)
-    assert len(response["results"]) > 0
-    for r in response["results"]:
+@pytest.fixture(scope="module")
+def failure_batch(session_client):
+    """Run the failure=true/false queries once per module
+    Returns {failure: results}
+    """
+    out = {}
+    for failure in ("true", "false"):
+        p = f"measurements?failure={failure}&since=2021-07-09&until=2021-07-10&limit=50"
+        out[failure == "true"] = api(session_client, p)["results"]
+    return out
+
+
+def test_list_measurements_failure_true_fastpath(failure_batch):
+    results = failure_batch[True]
+    assert len(results) > 0
+    for r in results:
         assert r["failure"] == True, r
 
 
-def test_list_measurements_failure_false_fastpath(client):
-    p = f"measurements?failure=false&since=2021-07-09&until=2021-07-10&limit=50"
-    response = api(client, p)
-    assert len(response["results"]) > 0
-    for r in response["results"]:
+def test_list_measurements_failure_false_fastpath(failure_batch):
+    results = failure_batch[False]
+    assert len(results) > 0
+    for r in results:
         assert r["failure"] == False, r
 
 
@@ -722,7 +739,7 @@ def test_list_measurements_paging_2(client):
     for pagenum in range(1, 999):
         resp = api(client, url)
         meta = resp["metadata"]
-        if pagenum < 4:
+        if pagenum < 3:
             assert meta["current_page"] == pagenum, url
             assert meta["offset"] == (pagenum - 1) * 100, url
             assert meta["count"] == -1, (url, meta)
@@ -730,15 +747,54 @@ def test_list_measurements_paging_2(client):
             assert meta["next_url"].startswith("https://api.ooni.io/api/v1/")
         else:  # last page
             assert meta["current_page"] == pagenum, url
-            assert meta["offset"] == 300, url
-            assert meta["count"] == 300, (url, meta)  # is this ok?
+            assert meta["offset"] == 200, url
+            assert meta["count"] == 300, (url, meta)
             assert meta["next_url"] is None
-            assert meta["pages"] == 3  # in this a bug?
+            assert meta["pages"] == 3
+            assert len(resp["results"]) == 100
             break
 
         url = meta["next_url"].split("/", 5)[-1]  # fetch next url
 
 
+def test_list_measurements_count_cache(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "LIST_MEASUREMENTS_COUNT_CACHE", True)
+    url = "measurements?since=2021-07-09&until=2021-07-10&test_name=web_connectivity&probe_cc=IE&limit=10"
+    # The first request schedules the count in background
+    for _ in range(60):
+        meta = api(client, url)["metadata"]
+        if meta["count"] != -1:
+            break
+        time.sleep(0.5)
+
+    assert meta["count"] == 300, meta
+    assert meta["pages"] == 30, meta
+    assert meta["current_page"] == 1
+
+
+def test_list_measurements_paging_cursor(client):
+    url = "measurements?since=2021-07-09&until=2021-07-10&test_name=web_connectivity&probe_cc=IE"
+    seen = set()
+    for pagenum in range(1, 5):
+        resp = api(client, url)
+        uids = [r["measurement_uid"] for r in resp["results"]]
+        assert seen.isdisjoint(uids)
+        seen.update(uids)
+        next_url = resp["metadata"]["next_url"]
+        if next_url is None:
+            break
+        assert "cursor=" in next_url
+        url = next_url.split("/", 5)[-1]
+
+    assert len(seen) == 300
+
+
+def test_list_measurements_paging_bad_cursor(client):
+    url = "measurements?since=2021-07-09&until=2021-07-10&cursor=bogus"
+    resp = client.get(f"/api/v1/{url}")
+    assert resp.status_code == 400
+
+
 def test_list_measurements_filter_category_code(client):
     # requires `citizenlab` to be populated
     p = "measurements?since=2021-7-9&until=2021-7-10&category_code=NEWS"
@@ -825,9 +881,15 @@ def test_list_measurements_filter_engine_version(client):
 ## get_measurement ##
 
 
-def test_get_measurement_found(client):
+@pytest.fixture(scope="module")
+def gold_measurement(session_client):
+    """Fetch and parse the reference measurement body once per module"""
     uid = "20210709005529.664022_MY_webconnectivity_68e5bea1060d1874"
-    response = api(client, f"measurement/{uid}")
+    return api(session_client, f"measurement/{uid}")
+
+
+def test_get_measurement_found(gold_measurement):
+    response = gold_measurement
     assert response["measurement_start_time"] == "2021-07-09 00:55:13"
     assert response["probe_asn"] == "AS4818"
     assert response["probe_cc"] == "MY"
@@ -901,12 +963,12 @@ def test_bug_355_anomaly(client):
 
 
 @pytest.mark.skipif(not pytest.proddb, reason="use --proddb to run")
-def test_bug_142_twitter(client):
+def test_bug_142_twitter(client, today_range):
     # we can assume there's always enough data
-    ts = datetime.utcnow().date().strftime("%Y-%m-%d")
+    ts = today_range[0]
     p = "measurements?domain=twitter.com&until=%s&limit=20" % ts
     response = api(client, p)
-    rows = tuple(response["results"])
+    rows = response["results"]
     assert len(rows) == 20
     for r in rows:
         assert "twitter" in r["input"], r
@@ -962,15 +1024,14 @@ def test_bug_list_measurements_anomaly_coalesce(client):
 
 
 @pytest.mark.skipif(not pytest.proddb, reason="use --proddb to run")
-def test_list_measurements_external_order_by(client):
+def test_list_measurements_external_order_by(client, today_range):
     # The last order-by on the rows from pipeline + fastpath
-    today = datetime.utcnow().date()
-    until = today + timedelta(days=1)
+    today, _, until = today_range
     url = f"measurements?until={until}&probe_cc=TR"
     response = api(client, url)
     last = max(r["measurement_start_time"] for r in response["results"])
     # Ensure that the newest msmt is from today (hence fastpath)
-    assert last[:10] == str(today)
+    assert last[:10] == today
     assert len(response["results"]) == 100, jd(response)
 
 
@@ -989,7 +1050,7 @@ def test_slow_inexistent_domain(client):
     # time-unbounded query, filtering by a domain never monitored
     p = "measurements?domain=meow.com&until=2019-12-11&limit=50"
     response = api(client, p)
-    rows = tuple(response["results"])
+    rows = response["results"]
     assert len(rows) == 0
 
 
@@ -998,7 +1059,7 @@ def test_slow_domain_unbounded(client):
     # time-unbounded query, filtering by a popular domain
     p = "measurements?domain=twitter.com&until=2019-12-11&limit=50"
     response = api(client, p)
-    rows = tuple(response["results"])
+    rows = response["results"]
     assert rows
 
 
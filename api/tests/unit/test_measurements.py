@@ -0,0 +1,23 @@
+import pytest
+
+from ooniapi.measurements import _slice_post_content
+
+
+def test_slice_post_content():
+    data = b'{"format": "json", "content": {"a": {"b": "}{"}, "c": "\\"}"}}\n'
+    assert _slice_post_content(data) == b'{"a": {"b": "}{"}, "c": "\\"}"}'
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b'{"format": "yaml", "content": {}}',
+        b'{"format": "json", "content": "foo"}',
+        b'{"format": "json", "content": {}, "x": 1}',
+        b'{"format": "json", "content": {}, "x": "}"}',
+        b'{"format": "json", "content": {"a": 1}, "x": {"b": 2}}',
+        b'{"format": "json", "content": {"a": "{"}, "x": {}}',
+    ],
+)
+def test_slice_post_content_other_layouts(data):
+    assert _slice_post_content(data) is None
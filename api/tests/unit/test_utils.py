@@ -0,0 +1,62 @@
+from ooniapi.utils import TTLCache, ttl_cache
+
+
+def test_ttl_cache():
+    calls = []
+
+    @ttl_cache("test", 2, 60, max_item_size=3)
+    def f(x):
+        calls.append(x)
+        return x
+
+    assert f("a") == "a"
+    assert f("a") == "a"
+    assert calls == ["a"]
+
+    # falsy and oversized values are not cached
+    f("")
+    f("")
+    f("long")
+    f("long")
+    assert calls == ["a", "", "", "long", "long"]
+
+    # least recently used entry is evicted
+    f("b")
+    f("c")
+    f("a")
+    assert calls[-3:] == ["b", "c", "a"]
+
+    f.cache_clear()
+    f("c")
+    assert calls[-1] == "c"
+
+
+def test_ttl_cache_expiry():
+    calls = []
+
+    @ttl_cache("test", 2, -1)
+    def f(x):
+        calls.append(x)
+        return x
+
+    f("a")
+    f("a")
+    assert calls == ["a", "a"]
+
+
+def test_ttl_cache_class():
+    c = TTLCache(2, 60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1
+    # "b" is the least recently used entry
+    c.set("c", 3)
+    assert len(c) == 2
+    assert c.get("b") is None
+    assert c.pop("a") == 1
+    assert c.pop("a", "missing") == "missing"
+
+    c = TTLCache(2, -1)
+    c.set("a", 1)
+    assert c.get("a") is None
+    assert len(c) == 0